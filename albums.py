@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Set
+
+logger = logging.getLogger(__name__)
+
+# Telegram albums hold at most 10 items
+MAX_ALBUM_SIZE = 10
+
+AlbumHandler = Callable[[List[Any], Any], Awaitable[None]]
+
+def build_album_prompt(prompt: str, count: int) -> str:
+    """Turn a single-photo prompt into one that compares count outfits"""
+    return (
+        f"You are given {count} photos, each showing a different outfit, numbered 1 to {count} "
+        "in the order they are shown. For each outfit, answer the instruction below briefly, "
+        "starting with its number.\n\n"
+        f"{prompt}\n\n"
+        "Then compare the outfits: say which one fits best and why, and what would "
+        "improve the others."
+    )
+
+class AlbumCollector:
+    """Collect the updates of one media group and handle them together.
+
+    Telegram delivers every photo of an album as a separate update with the
+    same media_group_id. The first one starts a timer; each further one
+    restarts it, and once no photo arrived for `window` seconds (or the album
+    is full) handle(updates, context) runs once in a background task. add()
+    returns immediately, so the updates that follow are not held up.
+    """
+
+    def __init__(self, handle: AlbumHandler, window: float = 1.0, max_items: int = MAX_ALBUM_SIZE):
+        self.handle = handle
+        self.window = window
+        self.max_items = max_items
+        self._albums: Dict[Hashable, List[Any]] = {}
+        self._last_seen: Dict[Hashable, float] = {}
+        self._full: Dict[Hashable, asyncio.Event] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        """Albums still being collected"""
+        return len(self._albums)
+
+    def add(self, key: Hashable, update: Any, context: Any):
+        """Buffer an update of the album identified by key"""
+        loop = asyncio.get_running_loop()
+        self._last_seen[key] = loop.time()
+        if key in self._albums:
+            self._albums[key].append(update)
+            if len(self._albums[key]) >= self.max_items:
+                self._full[key].set()
+            return
+
+        self._albums[key] = [update]
+        self._full[key] = asyncio.Event()
+        task = asyncio.create_task(self._collect(key, context))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _collect(self, key: Hashable, context: Any):
+        loop = asyncio.get_running_loop()
+        full = self._full[key]
+        while not full.is_set():
+            remaining = self._last_seen[key] + self.window - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(full.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+        updates = self._albums.pop(key)
+        del self._last_seen[key], self._full[key]
+        try:
+            await self.handle(updates, context)
+        except Exception as e:
+            logger.error(f"Error handling album of {len(updates)} photos: {e}", exc_info=e)
+
+    async def close(self):
+        """Handle the albums still being collected and wait for running handlers"""
+        for full in self._full.values():
+            full.set()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
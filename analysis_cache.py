@@ -0,0 +1,66 @@
+import hashlib
+import logging
+from typing import Optional
+from async_database import AsyncDatabase
+from memory_cache import MemoryCache
+
+logger = logging.getLogger(__name__)
+
+def normalize_event(event: Optional[str]) -> str:
+    """Normalize event text so equivalent spellings share a cache entry"""
+    return " ".join((event or "").lower().split())
+
+class AnalysisCache:
+    def __init__(self, database: AsyncDatabase, memory_size: int = 1024,
+                 db_size: int = 10000, ttl: int = 86400, prune_every: int = 100):
+        self.db = database
+        self.memory = MemoryCache(max_entries=memory_size, ttl=ttl)
+        self.db_size = db_size
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._writes_since_prune = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_hash: str, mode: str, event: Optional[str] = None) -> str:
+        """Build cache key from image hash, analysis mode and event text"""
+        # Event text only affects the prompt in special event mode
+        event_part = normalize_event(event) if mode == 'special_event' else ""
+        raw = f"{image_hash}:{mode}:{event_part}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """Get cached analysis from memory, falling back to the database"""
+        analysis = self.memory.get(key)
+        if analysis is not None:
+            return analysis
+
+        analysis = await self.db.get_cached_analysis(key, self.ttl)
+        if analysis is not None:
+            self.db_hits += 1
+            self.memory.set(key, analysis)
+            return analysis
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, analysis: str):
+        """Store analysis in both tiers"""
+        self.memory.set(key, analysis)
+        await self.db.save_cached_analysis(key, analysis)
+
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= self.prune_every:
+            self._writes_since_prune = 0
+            await self.db.prune_analysis_cache(self.db_size, self.ttl)
+
+    def stats(self) -> dict:
+        """Hit/miss counters for both tiers"""
+        return {
+            'memory_hits': self.memory.hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'memory_entries': len(self.memory),
+            'memory_evictions': self.memory.evictions,
+        }
@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+import metrics
+from gemini_scheduler import GeminiScheduler, PositionCallback
+
+logger = logging.getLogger(__name__)
+
+class AnalysisEngine:
+    def __init__(self, model, max_concurrency: int = 8, timeout: float = 60.0,
+                 scheduler: Optional[GeminiScheduler] = None):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        # The scheduler enforces the quota, per-user fairness and the in-flight cap
+        self.scheduler = scheduler or GeminiScheduler(max_in_flight=max_concurrency)
+        # Dedicated pool so blocking Gemini calls never run on the event loop
+        # or compete with the loop's default executor
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="gemini"
+        )
+
+    def _generate(self, contents: List[Any]) -> str:
+        """Blocking Gemini call, runs in the worker pool"""
+        response = self.model.generate_content(contents)
+        return response.text
+
+    def _generate_stream(self, contents: List[Any], on_text: Callable[[str], None],
+                         stop: threading.Event) -> str:
+        """Blocking streamed Gemini call, reporting the text received so far"""
+        parts = []
+        for chunk in self.model.generate_content(contents, stream=True):
+            if stop.is_set():
+                break
+            parts.append(chunk.text)
+            on_text(''.join(parts))
+        return ''.join(parts)
+
+    async def _call(self, contents: List[Any], on_text: Optional[Callable[[str], None]] = None) -> str:
+        loop = asyncio.get_running_loop()
+        stop = threading.Event()
+        # The worker thread runs in a copy of this context, keeping the trace id
+        context = contextvars.copy_context()
+        if on_text is None:
+            call = functools.partial(context.run, self._generate, contents)
+        else:
+            def report(text: str):
+                if not stop.is_set():
+                    loop.call_soon_threadsafe(on_text, text)
+            call = functools.partial(context.run, self._generate_stream, contents, report, stop)
+        job = self._executor.submit(call)
+        try:
+            with metrics.timer('bot_gemini_call_seconds', stream=on_text is not None):
+                return await asyncio.wait_for(asyncio.wrap_future(job), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # The worker thread cannot be interrupted; a plain call finishes
+            # in the background and its result is discarded, a stream stops
+            # at the next chunk. Its scheduler slot stays taken until then,
+            # so new calls do not queue behind it and time out in turn.
+            self.scheduler.hold_slot(job)
+            logger.error(f"Gemini call timed out after {self.timeout} seconds")
+            raise
+        finally:
+            stop.set()
+
+    async def analyze(self, prompt: str, image: Any, user_id: int = 0,
+                      on_queue_position: Optional[PositionCallback] = None,
+                      on_text: Optional[Callable[[str], None]] = None) -> str:
+        """Analyze an image, or a list of images, without blocking the event loop.
+
+        The call waits in the scheduler for user_id's turn; the timeout only
+        covers the Gemini call itself, not the time spent queued. With on_text
+        the response is streamed and on_text is called on the event loop with
+        the text received so far; the full text is still returned.
+        """
+        images = list(image) if isinstance(image, (list, tuple)) else [image]
+        return await self.scheduler.run(
+            user_id,
+            lambda: self._call([prompt, *images], on_text),
+            on_position=on_queue_position
+        )
+
+    def shutdown(self):
+        """Stop accepting new work and release worker threads"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,231 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+import metrics
+from database import Database, DatabaseBusyError
+from favorites_export import FavoritesExport
+from memory_cache import MemoryCache
+from write_behind import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+def _timed_call(func: Callable, *args) -> Any:
+    """Run func on a database thread, recording how long it took"""
+    with metrics.timer('bot_database_seconds', method=func.__name__):
+        return func(*args)
+
+class AsyncDatabase:
+    """Awaitable facade over Database.
+
+    Writes go through a single writer thread so they never contend with each
+    other inside the process; reads run on a small pool of reader threads
+    using WAL snapshots. Lock contention is retried with async backoff
+    instead of sleeping on a thread.
+
+    User sessions are fronted by a bounded write-through cache, so the
+    state, mode and event lookups on the hot path are served from memory.
+    Non-critical writes can be deferred to a write-behind queue that
+    coalesces them per user and group-commits them.
+    """
+
+    def __init__(self, db_name: str = "bot_data.db", readers: int = 4,
+                 retries: int = 5, retry_delay: float = 0.05,
+                 session_cache_size: int = 10000, flush_interval: float = 0.05,
+                 max_pending_writes: int = 100, **db_options):
+        # readers=0 keeps the legacy connection-per-query mode of Database,
+        # but reads still need a thread to run on
+        pool_size = readers + 1 if readers > 0 else 0
+        readers = max(1, readers)
+        self.db = Database(
+            db_name,
+            pool_size=pool_size,
+            busy_timeout=1,
+            raise_on_busy=True,
+            **db_options
+        )
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self.sessions = MemoryCache(max_entries=session_cache_size)
+        self.write_queue = WriteBehindQueue(
+            self._flush_writes,
+            flush_interval=flush_interval,
+            max_pending=max_pending_writes
+        )
+
+    async def _run(self, executor: ThreadPoolExecutor, func: Callable, *args) -> Any:
+        """Run a blocking Database call on executor, backing off while locked"""
+        loop = asyncio.get_running_loop()
+        # Run in a copy of the caller's context so log lines keep the update's trace id
+        call = functools.partial(contextvars.copy_context().run, _timed_call, func, *args)
+
+        for attempt in range(self.retries):
+            try:
+                return await loop.run_in_executor(executor, call)
+            except DatabaseBusyError as e:
+                if attempt == self.retries - 1:
+                    logger.error(f"Database still locked after {self.retries} attempts: {e}")
+                    raise
+                metrics.inc('bot_database_busy_total', method=func.__name__)
+                delay = self.retry_delay * (2 ** attempt)
+                logger.warning(f"Database locked, retrying in {delay:.2f}s (Attempt {attempt + 1}/{self.retries})")
+                await asyncio.sleep(delay)
+
+    async def _read(self, func: Callable, *args) -> Any:
+        return await self._run(self._readers, func, *args)
+
+    async def _write(self, func: Callable, *args) -> Any:
+        return await self._run(self._writer, func, *args)
+
+    async def _flush_writes(self, writes: List[Tuple[str, tuple]]) -> bool:
+        return await self._write(self.db.write_batch, writes)
+
+    async def flush(self):
+        """Write all deferred writes now"""
+        await self.write_queue.flush()
+
+    async def close(self):
+        """Flush deferred writes, wait for queued writes and close all connections"""
+        await self.write_queue.drain()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._writer.shutdown)
+        await loop.run_in_executor(None, self._readers.shutdown)
+        self.db.close()
+
+    async def get_user_session(self, user_id: int) -> dict:
+        """Get user state, mode and event, from memory when possible"""
+        session = self.sessions.get(user_id)
+        if session is None:
+            if self.write_queue.has_pending(('session', user_id)):
+                await self.write_queue.flush()
+            session = await self._read(self.db.get_user_session, user_id)
+            if session is None:
+                session = {'is_active': False, 'mode': None, 'event': None}
+            self.sessions.set(user_id, session)
+        return session
+
+    async def save_user_session(self, user_id: int, is_active: bool, mode: Optional[str],
+                                event: Optional[str], defer: bool = False) -> bool:
+        """Save the whole session in one write and update the cache.
+
+        With defer=True the cache is updated immediately and the database
+        write goes through the write-behind queue.
+        """
+        key = ('session', user_id)
+        if defer:
+            self.sessions.set(user_id, {'is_active': is_active, 'mode': mode, 'event': event})
+            self.write_queue.put(key, Database.session_writes(user_id, is_active, mode, event))
+            return True
+        
+        self.write_queue.discard(key)
+        success = await self._write(self.db.save_user_session, user_id, is_active, mode, event)
+        if success:
+            self.sessions.set(user_id, {'is_active': is_active, 'mode': mode, 'event': event})
+        else:
+            self.sessions.pop(user_id)
+        return success
+
+    async def update_user_session(self, user_id: int, defer: bool = False, **changes) -> bool:
+        """Change some session fields, keeping the others"""
+        session = dict(await self.get_user_session(user_id))
+        session.update(changes)
+        return await self.save_user_session(
+            user_id, session['is_active'], session['mode'], session['event'], defer=defer
+        )
+
+    async def reset_user_session(self, user_id: int) -> bool:
+        """End the session and clear mode and event"""
+        return await self.save_user_session(user_id, False, None, "")
+
+    async def set_user_state(self, user_id: int, is_active: bool, defer: bool = False) -> bool:
+        """Set user state"""
+        return await self.update_user_session(user_id, defer=defer, is_active=is_active)
+
+    async def get_user_state(self, user_id: int) -> bool:
+        """Get user state"""
+        return (await self.get_user_session(user_id))['is_active']
+
+    async def set_user_preference(self, user_id: int, mode: Optional[str]) -> bool:
+        """Set user preference"""
+        return await self.update_user_session(user_id, mode=mode)
+
+    async def get_user_preference(self, user_id: int) -> Optional[str]:
+        """Get user preference"""
+        return (await self.get_user_session(user_id))['mode']
+
+    async def set_user_event(self, user_id: int, event: str) -> bool:
+        """Set user event"""
+        return await self.update_user_session(user_id, event=event)
+
+    async def get_user_event(self, user_id: int) -> Optional[str]:
+        """Get user event"""
+        return (await self.get_user_session(user_id))['event']
+
+    async def add_favorite(self, user_id: int, analysis: str, mode: str) -> bool:
+        """Add favorite"""
+        return await self._write(self.db.add_favorite, user_id, analysis, mode)
+
+    async def get_user_favorites(self, user_id: int) -> List[Tuple[int, str, str, str]]:
+        """Get user favorites"""
+        return await self._read(self.db.get_user_favorites, user_id)
+
+    async def get_favorites_page(self, user_id: int, limit: int,
+                                 cursor: Optional[Tuple[str, int]] = None,
+                                 direction: str = 'next') -> Tuple[List[Tuple[int, str, str, str]], int]:
+        """Get one page of user favorites and the total count"""
+        return await self._read(self.db.get_favorites_page, user_id, limit, cursor, direction)
+
+    async def export_favorites(self, user_id: int, path: str, fmt: str = 'txt', batch_size: int = 100) -> int:
+        """Write all user favorites to a gzip-compressed file at path on a reader thread.
+
+        The file is opened, written and closed on the thread. A retry after a
+        busy error starts the file over, so no row is written twice.
+        """
+        def export_favorites() -> int:
+            with FavoritesExport(path, fmt) as export:
+                return self.db.export_favorites(user_id, export.write, batch_size)
+
+        return await self._read(export_favorites)
+
+    async def search_favorites(self, user_id: int, terms: str, limit: int = 10) -> List[Tuple[int, str, str, str]]:
+        """Search user favorites, best match first"""
+        return await self._read(self.db.search_favorites, user_id, terms, limit)
+
+    async def delete_favorite(self, favorite_id: int, user_id: int) -> bool:
+        """Delete favorite"""
+        return await self._write(self.db.delete_favorite, favorite_id, user_id)
+
+    async def delete_all_favorites(self, user_id: int) -> int:
+        """Delete all favorites"""
+        return await self._write(self.db.delete_all_favorites, user_id)
+
+    async def save_last_analysis(self, user_id: int, analysis: str, defer: bool = False) -> bool:
+        """Save last analysis"""
+        key = ('last_analysis', user_id)
+        if defer:
+            self.write_queue.put(key, Database.last_analysis_writes(user_id, analysis))
+            return True
+        self.write_queue.discard(key)
+        return await self._write(self.db.save_last_analysis, user_id, analysis)
+
+    async def get_last_analysis(self, user_id: int) -> Optional[str]:
+        """Get last analysis"""
+        if self.write_queue.has_pending(('last_analysis', user_id)):
+            await self.write_queue.flush()
+        return await self._read(self.db.get_last_analysis, user_id)
+
+    async def get_cached_analysis(self, cache_key: str, ttl: int) -> Optional[str]:
+        """Get cached analysis if it is younger than ttl seconds"""
+        return await self._read(self.db.get_cached_analysis, cache_key, ttl)
+
+    async def save_cached_analysis(self, cache_key: str, analysis: str) -> bool:
+        """Save analysis to cache"""
+        return await self._write(self.db.save_cached_analysis, cache_key, analysis)
+
+    async def prune_analysis_cache(self, max_entries: int, ttl: int) -> int:
+        """Delete expired cache entries and the oldest ones beyond max_entries"""
+        return await self._write(self.db.prune_analysis_cache, max_entries, ttl)
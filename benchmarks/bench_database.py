@@ -0,0 +1,60 @@
+"""Compare per-query connections with the pooled WAL connection mode.
+
+Usage:
+    python benchmarks/bench_database.py [--ops 5000] [--users 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import Database
+
+ANALYSIS_TEXT = (
+    "1. Outfit in photo: navy blazer, white shirt, grey trousers\n"
+    "2. Suggested business outfit: add a silk tie and brown oxfords\n"
+    "3. Style tips: keep colours muted for client meetings\n"
+) * 8
+
+def run(db: Database, ops: int, users: int) -> dict:
+    """Run both hot paths and return ops/sec for each"""
+    for user_id in range(users):
+        db.set_user_state(user_id, True)
+
+    start = time.perf_counter()
+    for i in range(ops):
+        db.get_user_state(i % users)
+    read_rate = ops / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(ops):
+        db.save_last_analysis(i % users, ANALYSIS_TEXT)
+    write_rate = ops / (time.perf_counter() - start)
+
+    return {'get_user_state': read_rate, 'save_last_analysis': write_rate}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--pool-size', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, pool_size in (('per-query', 0), ('pooled', args.pool_size)):
+            db = Database(os.path.join(tmp, f"{label}.db"), pool_size=pool_size)
+            results[label] = run(db, args.ops, args.users)
+            db.close()
+
+    print(f"{'path':<20}{'per-query ops/s':>18}{'pooled ops/s':>16}{'speedup':>10}")
+    for path in ('get_user_state', 'save_last_analysis'):
+        before = results['per-query'][path]
+        after = results['pooled'][path]
+        print(f"{path:<20}{before:>18.0f}{after:>16.0f}{after / before:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
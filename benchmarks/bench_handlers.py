@@ -0,0 +1,170 @@
+"""Drive the bot's handlers offline and report latency and database load.
+
+Runs handle_photo, show_favorites, button_callback, /last and finish_command
+with fake updates against a temporary SQLite file and a stubbed Gemini
+model, and prints throughput, p50/p95/p99 latency and database operations
+per update for each.
+
+Usage:
+    python benchmarks/bench_handlers.py [--updates 200] [--users 50] [--concurrency 20]
+        [--gemini-latency 0.5] [--telegram-latency 0.0] [--photos 20]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fakes import (ANALYSIS_TEXT, FakeContext, FakeTelegram, StubModel,
+                   callback_update, command_update, make_photo, photo_update)
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def run_scenario(bot, metrics, name: str, count: int, concurrency: int,
+                       make_call: Callable[[int], Awaitable]) -> dict:
+    """Run count handler calls, at most concurrency at a time"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one(index: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await make_call(index)
+            latencies.append(time.perf_counter() - start)
+
+    db_ops_before = metrics.total('bot_database_seconds')
+    errors_before = metrics.total('bot_errors_total')
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(count)))
+    # Deferred writes belong to the updates that queued them
+    await bot.db.flush()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'name': name,
+        'rate': count / elapsed,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'mean': statistics.mean(latencies) * 1000,
+        'db_ops': (metrics.total('bot_database_seconds') - db_ops_before) / count,
+        'errors': metrics.total('bot_errors_total') - errors_before,
+    }
+
+async def run(args, bot, metrics) -> List[dict]:
+    telegram = FakeTelegram(args.telegram_latency)
+    contexts: Dict[int, FakeContext] = {}
+
+    def context_for(user_id: int) -> FakeContext:
+        return contexts.setdefault(user_id, FakeContext())
+
+    def user_for(index: int) -> int:
+        return 1000 + index % args.users
+
+    for user_id in range(1000, 1000 + args.users):
+        await bot.db.save_user_session(user_id, True, 'professional', "")
+        for _ in range(args.favorites):
+            await bot.db.add_favorite(user_id, ANALYSIS_TEXT, 'professional')
+
+    photos = [make_photo(seed=seed) for seed in range(1, args.photos + 1)]
+
+    async def send_photo(index: int):
+        user_id = user_for(index)
+        photo_index = index % len(photos)
+        update = photo_update(telegram, user_id, photos[photo_index], f"photo-{photo_index}")
+        await bot.handle_photo(update, context_for(user_id))
+
+    async def open_favorites(index: int):
+        user_id = user_for(index)
+        await bot.show_favorites(command_update(telegram, user_id, '/favorites'), context_for(user_id))
+
+    async def press_button(index: int):
+        user_id = user_for(index)
+        data = ('next_favorites', 'prev_favorites', 'fashion', 'professional')[index // args.users % 4]
+        await bot.button_callback(callback_update(telegram, user_id, data), context_for(user_id))
+
+    async def show_last(index: int):
+        user_id = user_for(index)
+        update = command_update(telegram, user_id, '/last')
+        await bot.quick_actions.show_last_analysis(update, context_for(user_id))
+
+    async def finish(index: int):
+        user_id = user_for(index)
+        await bot.finish_command(command_update(telegram, user_id, '/finish'), context_for(user_id))
+
+    scenarios = [
+        ('handle_photo', send_photo),
+        ('show_favorites', open_favorites),
+        ('button_callback', press_button),
+        ('show_last_analysis', show_last),
+        # Ends every session, so it runs once per user and last
+        ('finish_command', finish),
+    ]
+    results = []
+    for name, make_call in scenarios:
+        count = args.users if name == 'finish_command' else args.updates
+        results.append(await run_scenario(bot, metrics, name, count, args.concurrency, make_call))
+    results[0]['gemini_calls'] = bot.analysis_engine.model.calls
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=200, help='Updates per scenario')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=20, help='Updates handled at the same time')
+    parser.add_argument('--gemini-latency', type=float, default=0.5, help='Stubbed Gemini latency in seconds')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='Latency of every fake Telegram call')
+    parser.add_argument('--photos', type=int, default=20, help='Distinct photos sent (repeats hit the cache)')
+    parser.add_argument('--favorites', type=int, default=5, help='Favorites stored per user')
+    parser.add_argument('--stream', action='store_true', help='Stream Gemini answers into the message')
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    # main.py reads its configuration when imported
+    os.environ.update({
+        'DATABASE_PATH': os.path.join(workdir.name, 'bench.db'),
+        'TELEGRAM_TOKEN': '0:offline',
+        'IMAGE_WORKERS': '0',
+        'GEMINI_STREAM': 'true' if args.stream else 'false',
+        'GEMINI_RATE_PER_MINUTE': '1000000',
+        'GEMINI_BURST': '1000',
+        'STREAM_EDIT_INTERVAL': '0',
+    })
+    os.chdir(workdir.name)
+
+    import main as bot
+    import metrics
+    from analysis_engine import AnalysisEngine
+    from gemini_scheduler import GeminiScheduler
+
+    bot.analysis_engine = AnalysisEngine(
+        StubModel(args.gemini_latency),
+        max_concurrency=bot.GEMINI_MAX_CONCURRENCY,
+        scheduler=GeminiScheduler(rate_per_minute=1e6, burst=1000, max_in_flight=bot.GEMINI_MAX_CONCURRENCY)
+    )
+    metrics.enable()
+
+    async def bench():
+        try:
+            return await run(args, bot, metrics)
+        finally:
+            await bot.post_shutdown(None)
+
+    results = asyncio.run(bench())
+    workdir.cleanup()
+
+    print(f"{'handler':<20}{'updates/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db ops/update':>15}{'errors':>8}")
+    for result in results:
+        print(f"{result['name']:<20}{result['rate']:>10.1f}{result['p50']:>9.1f}{result['p95']:>9.1f}"
+              f"{result['p99']:>9.1f}{result['db_ops']:>15.2f}{result['errors']:>8.0f}")
+    print(f"\nGemini calls for {args.updates} photos: {results[0]['gemini_calls']}")
+
+if __name__ == '__main__':
+    main()
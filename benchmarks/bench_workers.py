@@ -0,0 +1,89 @@
+"""Measure photo analysis throughput for different numbers of bot workers.
+
+Each job preprocesses a full-size photo with Pillow and calls a stubbed
+Gemini model that only sleeps, so no network or API key is needed. Jobs
+are routed by user id exactly as the front process routes updates.
+
+Usage:
+    python benchmarks/bench_workers.py [--workers 1 2 4] [--jobs 400] [--users 50] [--latency 0.2]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from analysis_engine import AnalysisEngine
+from gemini_scheduler import GeminiScheduler
+from image_processing import ImagePreprocessor
+from workers import WorkerPool, serve_queue
+from fakes import StubModel, make_photo
+
+def bench_worker(index: int, queue, results, latency: float, concurrency: int):
+    photo = make_photo()
+    preprocessor = ImagePreprocessor(workers=0)
+    engine = AnalysisEngine(
+        StubModel(latency),
+        max_concurrency=concurrency,
+        scheduler=GeminiScheduler(rate_per_minute=1e9, burst=concurrency, max_in_flight=concurrency)
+    )
+
+    async def handle(item):
+        user_id, sequence = item
+        processed = await preprocessor.process(photo)
+        await engine.analyze("Analyze this outfit", processed.as_blob(), user_id=user_id)
+        results.put((user_id, sequence))
+
+    asyncio.run(serve_queue(queue, handle))
+    engine.shutdown()
+    preprocessor.shutdown()
+
+def run(workers: int, jobs: int, users: int, latency: float, concurrency: int) -> dict:
+    results = multiprocessing.get_context('spawn').Queue()
+    pool = WorkerPool(workers, bench_worker, args=(results, latency, concurrency))
+    pool.start()
+
+    # Warm up: one job per worker so process start-up is not measured
+    for index in range(workers):
+        pool.submit(index, (index, -1))
+    for _ in range(workers):
+        results.get()
+
+    start = time.perf_counter()
+    for sequence in range(jobs):
+        user_id = sequence % users
+        pool.submit(user_id, (user_id, sequence))
+
+    received = defaultdict(list)
+    for _ in range(jobs):
+        user_id, sequence = results.get()
+        received[user_id].append(sequence)
+    elapsed = time.perf_counter() - start
+    pool.stop()
+
+    in_order = all(sequences == sorted(sequences) for sequences in received.values())
+    return {'rate': jobs / elapsed, 'elapsed': elapsed, 'in_order': in_order}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--jobs', type=int, default=400)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.2, help='Stubbed Gemini latency in seconds')
+    parser.add_argument('--concurrency', type=int, default=8, help='Gemini calls in flight per worker')
+    args = parser.parse_args()
+
+    print(f"{'workers':>8}{'jobs/s':>10}{'elapsed s':>12}{'speedup':>10}{'per-user order':>16}")
+    baseline = None
+    for workers in args.workers:
+        result = run(workers, args.jobs, args.users, args.latency, args.concurrency)
+        baseline = baseline or result['rate']
+        print(f"{workers:>8}{result['rate']:>10.1f}{result['elapsed']:>12.2f}"
+              f"{result['rate'] / baseline:>9.1f}x{'kept' if result['in_order'] else 'BROKEN':>16}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""Local stand-ins for the Telegram Bot API and the Gemini REST API.
+
+Both are plain threaded HTTP servers on 127.0.0.1. FakeBotAPI serves
+getUpdates by long polling from an in-memory queue, records every message
+the bot sends or edits per chat, and serves photo downloads. FakeGemini
+answers generateContent and streamGenerateContent after a fixed latency.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qs, urlparse
+
+from fakes import ANALYSIS_TEXT
+from multi_mode import MULTI_MODES
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'load_test_bot'}
+
+class SentMessage(NamedTuple):
+    at: float
+    method: str
+    message_id: int
+    text: str
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status: int = 200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_params(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(body or '{}')
+        params = {key: values[-1] for key, values in parse_qs(body).items()}
+        params.update({key: values[-1] for key, values in parse_qs(urlparse(self.path).query).items()})
+        return params
+
+class _Server:
+    def __init__(self, handler: type, port: int = 0):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.service = self
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class _BotAPIHandler(_QuietHandler):
+    def do_GET(self):
+        # /file/bot<token>/<file_path>
+        service: FakeBotAPI = self.server.service
+        parts = self.path.split('/', 3)
+        data = service.files.get(parts[3]) if len(parts) == 4 and parts[1] == 'file' else None
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        # /bot<token>/<method>
+        service: FakeBotAPI = self.server.service
+        method = self.path.split('?')[0].rsplit('/', 1)[-1]
+        try:
+            result = service.handle(method, self.read_params())
+        except Exception as e:
+            self.send_json({'ok': False, 'error_code': 400, 'description': str(e)}, status=400)
+            return
+        self.send_json({'ok': True, 'result': result})
+
+class FakeBotAPI(_Server):
+    def __init__(self, photos: Dict[str, bytes], port: int = 0):
+        super().__init__(_BotAPIHandler, port)
+        self.files = {f"photos/{file_id}.jpg": data for file_id, data in photos.items()}
+        self.photos = photos
+        self.condition = threading.Condition()
+        self.polling = threading.Event()
+        self.sent: Dict[int, List[SentMessage]] = defaultdict(list)
+        self._updates: List[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    def push_update(self, update: dict) -> float:
+        """Queue an update for the bot's next getUpdates and return the time"""
+        with self.condition:
+            update['update_id'] = next(self._update_ids)
+            self._updates.append(update)
+            self.condition.notify_all()
+            return time.perf_counter()
+
+    def next_message_id(self) -> int:
+        return next(self._message_ids)
+
+    def wait_for(self, chat_id: int, after: int, predicate: Callable[[SentMessage], bool],
+                 timeout: float) -> Optional[SentMessage]:
+        """Wait for a message to chat_id, sent after the first `after` ones, that matches predicate"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                for message in self.sent[chat_id][after:]:
+                    if predicate(message):
+                        return message
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def _get_updates(self, params: dict) -> List[dict]:
+        self.polling.set()
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return self._updates[:limit]
+
+    def _record(self, method: str, params: dict) -> dict:
+        chat_id = int(params['chat_id'])
+        message_id = int(params.get('message_id') or self.next_message_id())
+        text = params.get('text', '')
+        with self.condition:
+            self.sent[chat_id].append(SentMessage(time.perf_counter(), method, message_id, text))
+            self.condition.notify_all()
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': text,
+        }
+
+    def handle(self, method: str, params: dict):
+        self.calls[method] += 1
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method in ('sendMessage', 'editMessageText'):
+            return self._record(method, params)
+        if method == 'getFile':
+            file_id = params['file_id']
+            return {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_size': len(self.photos[file_id]),
+                'file_path': f"photos/{file_id}.jpg",
+            }
+        # deleteWebhook, setMyCommands, answerCallbackQuery, deleteMessage, ...
+        return True
+
+class _GeminiHandler(_QuietHandler):
+    def do_POST(self):
+        service: FakeGemini = self.server.service
+        request = self.read_params()
+        prompt = " ".join(
+            part.get('text', '')
+            for content in request.get('contents', [])
+            for part in content.get('parts', [])
+        )
+        text = service.answer(prompt)
+
+        if ':streamGenerateContent' in self.path:
+            # A JSON array written piece by piece, as the REST transport expects
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            size = max(1, len(text) // service.chunks)
+            pieces = [text[start:start + size] for start in range(0, len(text), size)]
+            self.wfile.write(b'[')
+            for index, piece in enumerate(pieces):
+                time.sleep(service.latency / len(pieces))
+                separator = b',' if index else b''
+                self.wfile.write(separator + json.dumps(service.response(piece)).encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b']')
+            self.close_connection = True
+            return
+
+        time.sleep(service.latency)
+        self.send_json(service.response(text))
+
+class FakeGemini(_Server):
+    def __init__(self, latency: float = 1.0, port: int = 0, chunks: int = 8):
+        super().__init__(_GeminiHandler, port)
+        self.latency = latency
+        self.chunks = chunks
+        self.requests = 0
+
+    def answer(self, prompt: str) -> str:
+        self.requests += 1
+        if 'JSON object' in prompt:
+            return json.dumps({mode: ANALYSIS_TEXT for mode in MULTI_MODES})
+        return ANALYSIS_TEXT
+
+    @staticmethod
+    def response(text: str) -> dict:
+        return {
+            'candidates': [{
+                'content': {'parts': [{'text': text}], 'role': 'model'},
+                'finishReason': 'STOP',
+                'index': 0,
+            }]
+        }
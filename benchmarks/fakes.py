@@ -0,0 +1,170 @@
+"""Offline stand-ins for Telegram updates and the Gemini model.
+
+Only the attributes and coroutines the bot's handlers touch are provided.
+Every outgoing Telegram call can be given a fixed latency.
+"""
+import asyncio
+import io
+import itertools
+import time
+from typing import Iterator, List, Optional
+
+from PIL import Image
+
+ANALYSIS_TEXT = (
+    "1. Outfit in photo: navy blazer, white shirt, grey trousers\n"
+    "2. Suggested business outfit: add a silk tie and brown oxfords\n"
+    "3. Style tips: keep colours muted for client meetings\n"
+) * 4
+
+_ids = itertools.count(1)
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class StubModel:
+    """Stands in for GenerativeModel with a fixed response latency"""
+
+    def __init__(self, latency: float = 0.0, text: str = ANALYSIS_TEXT, chunks: int = 8):
+        self.latency = latency
+        self.text = text
+        self.chunks = chunks
+        self.calls = 0
+
+    def _stream(self) -> Iterator[StubResponse]:
+        size = max(1, len(self.text) // self.chunks)
+        for start in range(0, len(self.text), size):
+            time.sleep(self.latency / self.chunks)
+            yield StubResponse(self.text[start:start + size])
+
+    def generate_content(self, contents, stream: bool = False):
+        self.calls += 1
+        if stream:
+            return self._stream()
+        time.sleep(self.latency)
+        return StubResponse(self.text)
+
+def make_photo(size=(1280, 960), seed: int = 0) -> bytes:
+    """A noisy JPEG about the size of a Telegram photo; seeds give different images"""
+    image = Image.effect_noise(size, 48).convert('RGB')
+    if seed:
+        overlay = Image.linear_gradient('L').resize(size).rotate(seed * 37 % 360)
+        image = Image.composite(image, Image.new('RGB', size, (seed * 53 % 256, 90, 140)), overlay)
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+class FakeTelegram:
+    """Shared settings and call counter for fake Telegram objects"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.is_bot = False
+        self.first_name = "Bench"
+
+class FakeFile:
+    def __init__(self, telegram: FakeTelegram, data: bytes):
+        self._telegram = telegram
+        self._data = data
+        self.file_size = len(data)
+
+    async def download_as_bytearray(self) -> bytearray:
+        await self._telegram.call()
+        return bytearray(self._data)
+
+class FakePhotoSize:
+    def __init__(self, telegram: FakeTelegram, data: bytes, width: int, height: int, file_unique_id: str):
+        self._telegram = telegram
+        self._data = data
+        self.width = width
+        self.height = height
+        self.file_id = file_unique_id
+        self.file_unique_id = file_unique_id
+        self.file_size = len(data)
+
+    async def get_file(self) -> FakeFile:
+        await self._telegram.call()
+        return FakeFile(self._telegram, self._data)
+
+class FakeMessage:
+    def __init__(self, telegram: FakeTelegram, user: FakeUser, text: Optional[str] = None,
+                 photo: Optional[List[FakePhotoSize]] = None, media_group_id: Optional[str] = None):
+        self._telegram = telegram
+        self.message_id = next(_ids)
+        self.from_user = user
+        self.chat_id = user.id
+        self.text = text
+        self.photo = photo or []
+        self.media_group_id = media_group_id
+        self.replies: List[str] = []
+
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self._telegram.call()
+        self.replies.append(text)
+        return FakeMessage(self._telegram, self.from_user, text)
+
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self._telegram.call()
+        self.text = text
+        return self
+
+    async def delete(self) -> bool:
+        await self._telegram.call()
+        return True
+
+class FakeCallbackQuery:
+    def __init__(self, telegram: FakeTelegram, user: FakeUser, data: str, message: FakeMessage):
+        self._telegram = telegram
+        self.from_user = user
+        self.data = data
+        self.message = message
+
+    async def answer(self, *args, **kwargs) -> bool:
+        await self._telegram.call()
+        return True
+
+    async def edit_message_text(self, text: str, **kwargs) -> FakeMessage:
+        return await self.message.edit_text(text, **kwargs)
+
+class FakeUpdate:
+    def __init__(self, message: Optional[FakeMessage] = None,
+                 callback_query: Optional[FakeCallbackQuery] = None):
+        self.update_id = next(_ids)
+        self.message = message
+        self.callback_query = callback_query
+        self.edited_message = None
+        self.effective_user = (message or callback_query).from_user
+        self.effective_message = message or (callback_query.message if callback_query else None)
+
+class FakeContext:
+    def __init__(self, args: Optional[List[str]] = None):
+        self.user_data: dict = {}
+        self.args = args or []
+        self.error: Optional[Exception] = None
+
+def command_update(telegram: FakeTelegram, user_id: int, text: str) -> FakeUpdate:
+    return FakeUpdate(message=FakeMessage(telegram, FakeUser(user_id), text))
+
+def photo_update(telegram: FakeTelegram, user_id: int, data: bytes, photo_id: str,
+                 size=(1280, 960), media_group_id: Optional[str] = None) -> FakeUpdate:
+    # Telegram sends several sizes of every photo; all fakes share the same bytes
+    sizes = [
+        FakePhotoSize(telegram, data, size[0] * scale // 4, size[1] * scale // 4, f"{photo_id}-{scale}")
+        for scale in (1, 2, 4)
+    ]
+    return FakeUpdate(message=FakeMessage(telegram, FakeUser(user_id), photo=sizes, media_group_id=media_group_id))
+
+def callback_update(telegram: FakeTelegram, user_id: int, data: str) -> FakeUpdate:
+    user = FakeUser(user_id)
+    return FakeUpdate(callback_query=FakeCallbackQuery(telegram, user, data, FakeMessage(telegram, user)))
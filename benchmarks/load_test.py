@@ -0,0 +1,211 @@
+"""End-to-end load test of the bot against local fake Telegram and Gemini servers.
+
+Starts FakeBotAPI and FakeGemini, runs main.py against them in a
+subprocess (polling, temporary database), and starts synthetic user
+sessions at a fixed rate. Every session sends /start, picks a mode, sends
+a photo, saves the analysis and pages through favorites, waiting for the
+bot's reply to each step. Reports sustained updates/s and per-step latency.
+
+Bot settings such as BOT_WORKERS or GEMINI_STREAM are taken from the
+environment.
+
+Usage:
+    python benchmarks/load_test.py [--rate 2] [--duration 30] [--gemini-latency 1.0]
+        [--think 0.0] [--photos 20] [--timeout 60]
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from fake_services import BOT_USER, FakeBotAPI, FakeGemini, SentMessage
+from fakes import make_photo
+
+PHOTO_SIZES = ((320, 240), (640, 480), (1280, 960))
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+class Session:
+    """One synthetic user walking through the main flow"""
+
+    def __init__(self, api: FakeBotAPI, user_id: int, photo_id: str, timeout: float, think: float):
+        self.api = api
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+        self.chat = {'id': user_id, 'type': 'private'}
+        self.photo_id = photo_id
+        self.timeout = timeout
+        self.think = think
+        self.last_message: Optional[SentMessage] = None
+
+    def _message(self, **fields) -> dict:
+        return {
+            'message_id': self.api.next_message_id(),
+            'date': int(time.time()),
+            'chat': self.chat,
+            'from': self.user,
+            **fields,
+        }
+
+    def command(self, text: str) -> dict:
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return {'message': self._message(text=text, entities=entities)}
+
+    def photo(self) -> dict:
+        size = len(self.api.photos[self.photo_id])
+        photo = [
+            {'file_id': self.photo_id, 'file_unique_id': self.photo_id,
+             'width': width, 'height': height, 'file_size': size}
+            for width, height in PHOTO_SIZES
+        ]
+        return {'message': self._message(photo=photo)}
+
+    def button(self, data: str) -> dict:
+        # Buttons are pressed on the last message the bot sent
+        message = {
+            'message_id': self.last_message.message_id,
+            'date': int(time.time()),
+            'chat': self.chat,
+            'from': BOT_USER,
+            'text': self.last_message.text,
+        }
+        return {'callback_query': {
+            'id': uuid.uuid4().hex,
+            'from': self.user,
+            'chat_instance': str(self.user['id']),
+            'data': data,
+            'message': message,
+        }}
+
+    def step(self, update: Callable[[], dict], expect: Callable[[SentMessage], bool]) -> Optional[float]:
+        """Send an update and return the latency until the expected reply"""
+        after = len(self.api.sent[self.user['id']])
+        sent_at = self.api.push_update(update())
+        reply = self.api.wait_for(self.user['id'], after, expect, self.timeout)
+        if reply is None:
+            return None
+        self.last_message = reply
+        if self.think:
+            time.sleep(self.think)
+        return reply.at - sent_at
+
+    def steps(self):
+        def text_has(fragment: str, method: Optional[str] = None):
+            return lambda message: fragment in message.text and (method is None or message.method == method)
+
+        return [
+            ('start', lambda: self.command('/start'), text_has("select the most suitable profile")),
+            ('select_mode', lambda: self.button('professional'), text_has("You've selected", 'editMessageText')),
+            ('photo', self.photo, text_has("Here are my suggestions")),
+            ('quick_save', lambda: self.button('quick_save'), text_has("favorites")),
+            ('favorites', lambda: self.command('/favorites'), text_has("Your Favorite Outfits")),
+            ('next_page', lambda: self.button('next_favorites'), text_has("Your Favorite Outfits", 'editMessageText')),
+        ]
+
+def run_session(session: Session, results: Dict[str, List[Optional[float]]], lock: threading.Lock):
+    for name, update, expect in session.steps():
+        latency = session.step(update, expect)
+        with lock:
+            results[name].append(latency)
+        if latency is None:
+            # Without the reply the rest of the flow cannot continue
+            break
+
+def start_bot(api: FakeBotAPI, gemini: FakeGemini, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_TOKEN': '123456:load-test',
+        'TELEGRAM_API_URL': api.url,
+        'GEMINI_API_KEY': 'load-test',
+        'GEMINI_API_ENDPOINT': gemini.url,
+        'DATABASE_PATH': os.path.join(workdir, 'load_test.db'),
+        'TRANSPORT': 'polling',
+    })
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'main.py')],
+        cwd=workdir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def stop_bot(process: subprocess.Popen):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=2.0, help='New sessions per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to keep starting sessions')
+    parser.add_argument('--gemini-latency', type=float, default=1.0)
+    parser.add_argument('--think', type=float, default=0.0, help='Pause between steps of a session')
+    parser.add_argument('--photos', type=int, default=20, help='Distinct photos (repeats hit the analysis cache)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Seconds to wait for each reply')
+    args = parser.parse_args()
+
+    photos = {f"photo{seed}": make_photo(seed=seed) for seed in range(1, args.photos + 1)}
+    api = FakeBotAPI(photos)
+    gemini = FakeGemini(latency=args.gemini_latency)
+    api.start()
+    gemini.start()
+
+    workdir = tempfile.TemporaryDirectory()
+    bot = start_bot(api, gemini, workdir.name)
+    try:
+        if not api.polling.wait(60):
+            raise SystemExit("The bot did not start polling within 60 seconds")
+
+        results: Dict[str, List[Optional[float]]] = defaultdict(list)
+        lock = threading.Lock()
+        photo_ids = list(photos)
+        sessions = int(args.rate * args.duration)
+        executor = ThreadPoolExecutor(max_workers=max(1, sessions))
+
+        start = time.perf_counter()
+        futures = []
+        for index in range(sessions):
+            session = Session(api, 10000 + index, photo_ids[index % len(photo_ids)], args.timeout, args.think)
+            futures.append(executor.submit(run_session, session, results, lock))
+            # Fixed arrival rate, independent of how fast the bot answers
+            delay = start + (index + 1) / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+        executor.shutdown()
+    finally:
+        stop_bot(bot)
+        api.stop()
+        gemini.stop()
+        workdir.cleanup()
+
+    completed = sum(1 for latencies in results.values() for latency in latencies if latency is not None)
+    print(f"sessions: {sessions}  updates answered: {completed}  in {elapsed:.1f}s "
+          f"({completed / elapsed:.1f} updates/s sustained)")
+    print(f"Gemini requests: {gemini.requests}\n")
+    print(f"{'step':<14}{'ok':>6}{'timeouts':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, latencies in results.items():
+        answered = [latency * 1000 for latency in latencies if latency is not None]
+        timeouts = len(latencies) - len(answered)
+        if answered:
+            print(f"{name:<14}{len(answered):>6}{timeouts:>10}{percentile(answered, 50):>10.1f}"
+                  f"{percentile(answered, 95):>10.1f}{percentile(answered, 99):>10.1f}{max(answered):>10.1f}")
+        else:
+            print(f"{name:<14}{0:>6}{timeouts:>10}")
+
+if __name__ == '__main__':
+    main()
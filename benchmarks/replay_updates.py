@@ -0,0 +1,224 @@
+"""Replay Telegram updates through the bot's webhook and report handling latency.
+
+Starts FakeBotAPI and FakeGemini, runs main.py against them with
+TRANSPORT=webhook, and posts every update to the webhook. Latency is
+measured from the post until the bot's first sendMessage or
+editMessageText to that chat arrives at the fake Bot API, so it covers
+queueing, the handler and the reply. The time until the webhook answers
+(the update is only queued then) is reported separately.
+
+    python benchmarks/replay_updates.py [--updates updates.jsonl] [--count 1000]
+        [--concurrency 20] [--users 100] [--reply-timeout 30]
+
+--updates takes a JSON array or JSON lines of Update objects, for example
+update.to_dict() dumps. Without it, synthetic /help, /tips and /faq
+messages are sent. update_id values are rewritten so every post is new.
+Only one update per chat is in flight at a time, so each reply can be
+matched to its update. Recorded photos are not served by the fake API.
+Bot settings such as MAX_CONCURRENT_UPDATES are taken from the environment.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import secrets
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from fake_services import FakeBotAPI, FakeGemini
+
+SYNTHETIC_COMMANDS = ('/help', '/tips', '/faq')
+REPLY_METHODS = ('sendMessage', 'editMessageText')
+
+def synthetic_update(index: int, users: int) -> dict:
+    user_id = 100000 + index % users
+    text = SYNTHETIC_COMMANDS[index % len(SYNTHETIC_COMMANDS)]
+    return {
+        'update_id': index,
+        'message': {
+            'message_id': index,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Load'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+        },
+    }
+
+def load_updates(path: str) -> List[dict]:
+    with open(path, encoding='utf-8') as f:
+        content = f.read().strip()
+    if content.startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+def chat_of(update: dict) -> Optional[int]:
+    for kind in ('message', 'edited_message'):
+        if kind in update:
+            return update[kind]['chat']['id']
+    if 'callback_query' in update:
+        message = update['callback_query'].get('message')
+        return message['chat']['id'] if message else None
+    return None
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_bot(api: FakeBotAPI, gemini: FakeGemini, workdir: str, port: int, secret: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_TOKEN': '123456:replay',
+        'TELEGRAM_API_URL': api.url,
+        'GEMINI_API_KEY': 'replay',
+        'GEMINI_API_ENDPOINT': gemini.url,
+        'DATABASE_PATH': os.path.join(workdir, 'replay.db'),
+        'IMAGE_CACHE_DIR': os.path.join(workdir, 'image_cache'),
+        'TRANSPORT': 'webhook',
+        'WEBHOOK_LISTEN': '127.0.0.1',
+        'WEBHOOK_PORT': str(port),
+        'WEBHOOK_URL': f"http://127.0.0.1:{port}/telegram",
+        'WEBHOOK_SECRET_TOKEN': secret,
+    })
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'main.py')],
+        cwd=workdir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def stop_bot(process: subprocess.Popen):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+async def wait_for_webhook(client: httpx.AsyncClient, url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            # Without the secret header the bot answers 403, which proves it listens
+            await client.post(url, json={}, headers={'X-Telegram-Bot-Api-Secret-Token': ''})
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise SystemExit(f"The bot's webhook did not come up within {timeout:.0f} seconds")
+
+async def replay(api: FakeBotAPI, url: str, secret: str, updates: List[dict],
+                 concurrency: int, reply_timeout: float) -> dict:
+    latencies: List[float] = []
+    acks: List[float] = []
+    outcomes: Counter = Counter()
+    chat_locks: Dict[Optional[int], asyncio.Lock] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret}
+    async with httpx.AsyncClient(headers=headers, timeout=30) as client:
+        await wait_for_webhook(client, url)
+
+        async def send(update: dict):
+            chat_id = chat_of(update)
+            async with chat_locks.setdefault(chat_id, asyncio.Lock()):
+                after = len(api.sent[chat_id]) if chat_id is not None else 0
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, json=update)
+                except httpx.HTTPError as e:
+                    outcomes[type(e).__name__] += 1
+                    return
+                acks.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    outcomes[f"HTTP {response.status_code}"] += 1
+                    return
+                if chat_id is None:
+                    outcomes['no chat'] += 1
+                    return
+                reply = await asyncio.to_thread(
+                    api.wait_for, chat_id, after, lambda message: message.method in REPLY_METHODS, reply_timeout
+                )
+                if reply is None:
+                    outcomes['no reply'] += 1
+                    return
+                outcomes['replied'] += 1
+                latencies.append(reply.at - start)
+
+        async def worker():
+            while not queue.empty():
+                await send(queue.get_nowait())
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {'latencies': latencies, 'acks': acks, 'outcomes': outcomes, 'elapsed': elapsed}
+
+def print_latency(label: str, values: List[float]):
+    if not values:
+        return
+    values = [value * 1000 for value in values]
+    print(f"{label:<25}mean {statistics.mean(values):.1f}  p50 {percentile(values, 50):.1f}  "
+          f"p95 {percentile(values, 95):.1f}  p99 {percentile(values, 99):.1f}  max {max(values):.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', help='JSON or JSON lines file with recorded updates')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--users', type=int, default=100, help='Distinct users in synthetic updates')
+    parser.add_argument('--reply-timeout', type=float, default=30.0, help='Seconds to wait for each reply')
+    args = parser.parse_args()
+
+    if args.updates:
+        recorded = load_updates(args.updates)
+        updates = [dict(update) for update in itertools.islice(itertools.cycle(recorded), args.count)]
+    else:
+        updates = [synthetic_update(i, args.users) for i in range(args.count)]
+    first_id = int(time.time() * 1000)
+    for offset, update in enumerate(updates):
+        update['update_id'] = first_id + offset
+
+    api = FakeBotAPI({})
+    gemini = FakeGemini()
+    api.start()
+    gemini.start()
+    port = free_port()
+    secret = secrets.token_urlsafe(16)
+    workdir = tempfile.TemporaryDirectory()
+    bot = start_bot(api, gemini, workdir.name, port, secret)
+    try:
+        url = f"http://127.0.0.1:{port}/telegram"
+        result = asyncio.run(replay(api, url, secret, updates, args.concurrency, args.reply_timeout))
+    finally:
+        stop_bot(bot)
+        api.stop()
+        gemini.stop()
+        workdir.cleanup()
+
+    print(f"updates sent:  {len(updates)} in {result['elapsed']:.2f}s "
+          f"({len(updates) / result['elapsed']:.0f} updates/s)")
+    print(f"outcomes:      {dict(result['outcomes'])}")
+    print_latency("until reply (ms):", result['latencies'])
+    print_latency("until webhook 200 (ms):", result['acks'])
+
+if __name__ == '__main__':
+    main()
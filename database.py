@@ -1,36 +1,158 @@
+import hashlib
 import sqlite3
-from typing import List, Tuple, Optional
+import zlib
+from typing import Callable, List, Tuple, Optional
 from datetime import datetime
 from contextlib import contextmanager
 import logging
+import queue
+import threading
 import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+FAVORITES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS favorites (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        analysis_hash TEXT NOT NULL,
+        mode TEXT NOT NULL DEFAULT 'general',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+LAST_ANALYSIS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS last_analysis (
+        user_id INTEGER PRIMARY KEY,
+        analysis_hash TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Remove an analysis body once no favorite or last analysis refers to it
+DELETE_ORPHAN_BLOB_SQL = """
+    DELETE FROM analysis_blobs
+    WHERE hash = ?
+    AND NOT EXISTS (SELECT 1 FROM favorites WHERE analysis_hash = analysis_blobs.hash)
+    AND NOT EXISTS (SELECT 1 FROM last_analysis WHERE analysis_hash = analysis_blobs.hash)
+"""
+
+# Rows indexed for favorites search. The analysis text is decompressed by the
+# decompress_analysis() SQL function registered on every connection; owner is
+# a 'u<user_id>' token so a search can be limited to one user inside the index.
+# Only reads through the index (snippet() and 'rebuild') use the view.
+FAVORITES_FTS_SOURCE_SQL = """
+    CREATE VIEW IF NOT EXISTS favorites_fts_source AS
+    SELECT f.id, decompress_analysis(b.codec, b.body) AS analysis, f.mode, 'u' || f.user_id AS owner
+    FROM favorites f
+    JOIN analysis_blobs b ON b.hash = f.analysis_hash
+"""
+
+# External-content index: only the index is stored, the text stays compressed
+# in analysis_blobs and is read back through the view for snippet()
+FAVORITES_FTS_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS favorites_fts USING fts5(
+        analysis, mode, owner,
+        content = 'favorites_fts_source', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+# The index is updated by the methods that add and delete favorites, in the
+# same transaction, rather than by triggers: those would need
+# decompress_analysis() on every connection that writes to favorites.
+# The 'delete' command takes the values that were indexed.
+FAVORITES_FTS_INSERT_SQL = "INSERT INTO favorites_fts (rowid, analysis, mode, owner) VALUES (?, ?, ?, ?)"
+FAVORITES_FTS_DELETE_SQL = """
+    INSERT INTO favorites_fts (favorites_fts, rowid, analysis, mode, owner)
+    VALUES ('delete', ?, ?, ?, ?)
+"""
+
+# Bodies shorter than this are stored as-is; zlib gains little on them
+COMPRESS_MIN_SIZE = 256
+
+def analysis_hash(analysis: str) -> str:
+    """Content hash used as the key of an analysis body"""
+    return hashlib.sha256(analysis.encode('utf-8')).hexdigest()
+
+def compress_analysis(analysis: str) -> Tuple[str, bytes]:
+    """Encode analysis text for storage, returning (codec, body)"""
+    data = analysis.encode('utf-8')
+    if len(data) < COMPRESS_MIN_SIZE:
+        return 'raw', data
+    return 'zlib', zlib.compress(data, 9)
+
+def decompress_analysis(codec: str, body: bytes) -> str:
+    """Decode a stored analysis body"""
+    if codec == 'zlib':
+        body = zlib.decompress(body)
+    return bytes(body).decode('utf-8')
+
+def favorites_match_query(terms: str) -> Optional[str]:
+    """Turn free text into an FTS5 query: every word must match, as a prefix.
+
+    Words are quoted so FTS5 operators and punctuation typed by the user are
+    searched for literally instead of raising a syntax error.
+    """
+    words = [word.replace('"', '""') for word in terms.split()]
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+class DatabaseBusyError(Exception):
+    """Raised instead of blocking when the database is locked and the caller retries itself"""
+
+def is_busy_error(error: sqlite3.Error) -> bool:
+    """Check whether an SQLite error is caused by lock contention"""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
 class Database:
-    def __init__(self, db_name: str = "bot_data.db"):
+    def __init__(self, db_name: str = "bot_data.db", pool_size: int = 5,
+                 cache_size_kb: int = 16384, mmap_size: int = 268435456,
+                 statement_cache_size: int = 256, busy_timeout: float = 20,
+                 raise_on_busy: bool = False, vacuum_after_migration: bool = False):
         self.db_name = db_name
+        # pool_size=0 opens a fresh connection per query (legacy behaviour)
+        self.pool_size = pool_size
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.statement_cache_size = statement_cache_size
+        self.busy_timeout = busy_timeout
+        # When set, lock contention raises DatabaseBusyError instead of
+        # sleeping so an async caller can back off without blocking
+        self.raise_on_busy = raise_on_busy
+        # VACUUM rewrites the whole file, so startup only does it when asked
+        self.vacuum_after_migration = vacuum_after_migration
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._pool_lock = threading.Lock()
+        self._pool_created = 0
         self.init_db()
 
-    @contextmanager
-    def get_connection(self):
-        """Get database connection with context manager"""
-        conn = None
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection, retrying if the database is unavailable"""
         retries = 3  # Maximum retry attempts
         retry_delay = 1  # Retry wait time in seconds
         
         for attempt in range(retries):
+            conn = None
             try:
                 conn = sqlite3.connect(
                     self.db_name,
-                    timeout=20,
-                    isolation_level=None  # Automatic commit
+                    timeout=self.busy_timeout,
+                    isolation_level=None,  # Automatic commit
+                    check_same_thread=False,  # Pooled connections move between threads
+                    cached_statements=self.statement_cache_size
                 )
                 conn.row_factory = sqlite3.Row
-                yield conn
-                break
+                # Used by the favorites_fts_source view
+                conn.create_function('decompress_analysis', 2, decompress_analysis, deterministic=True)
+                if self.pool_size:
+                    self._configure_connection(conn)
+                return conn
                 
             except sqlite3.Error as e:
                 logger.error(f"Database connection error (Attempt {attempt + 1}/{retries}): {e}")
@@ -40,17 +162,98 @@ class Database:
                     except:
                         pass
                 
+                if self.raise_on_busy:
+                    raise DatabaseBusyError(str(e)) from e
                 if attempt < retries - 1:
                     time.sleep(retry_delay)
                 else:
                     raise
-                    
-            finally:
-                if conn:
-                    try:
-                        conn.close()
-                    except:
-                        pass
+
+    def _configure_connection(self, conn: sqlite3.Connection):
+        """Apply pragmas for long-lived pooled connections"""
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+
+    def _acquire_connection(self) -> sqlite3.Connection:
+        """Take a connection from the pool, opening one if the pool is not full"""
+        if not self.pool_size:
+            return self._connect()
+        
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._pool_lock:
+            can_create = self._pool_created < self.pool_size
+            if can_create:
+                self._pool_created += 1
+        
+        if can_create:
+            try:
+                return self._connect()
+            except (sqlite3.Error, DatabaseBusyError):
+                with self._pool_lock:
+                    self._pool_created -= 1
+                raise
+        
+        try:
+            return self._pool.get(timeout=20)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a pooled database connection")
+
+    def _release_connection(self, conn: sqlite3.Connection):
+        """Return a connection to the pool or close it"""
+        if not self.pool_size:
+            try:
+                conn.close()
+            except:
+                pass
+            return
+        
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+        except sqlite3.Error as e:
+            # Drop broken connections so a fresh one is opened next time
+            logger.error(f"Discarding pooled database connection: {e}")
+            with self._pool_lock:
+                self._pool_created -= 1
+            try:
+                conn.close()
+            except:
+                pass
+
+    @contextmanager
+    def get_connection(self):
+        """Get database connection with context manager"""
+        conn = self._acquire_connection()
+        try:
+            yield conn
+        except sqlite3.OperationalError as e:
+            if self.raise_on_busy and is_busy_error(e):
+                raise DatabaseBusyError(str(e)) from e
+            raise
+        finally:
+            self._release_connection(conn)
+
+    def close(self):
+        """Close all pooled connections"""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except:
+                pass
+            with self._pool_lock:
+                self._pool_created -= 1
 
     def init_db(self):
         """Initialize database tables"""
@@ -58,70 +261,266 @@ class Database:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                # User states table
+                # User sessions table (state, mode and event in one row)
                 cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS user_states (
+                    CREATE TABLE IF NOT EXISTS user_sessions (
                         user_id INTEGER PRIMARY KEY,
                         is_active BOOLEAN NOT NULL DEFAULT FALSE,
+                        mode TEXT,
+                        event TEXT,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
+                self._migrate_legacy_session_tables(cursor)
                 
-                # User preferences table
+                # Analysis bodies, stored once per distinct text and compressed
                 cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS user_preferences (
-                        user_id INTEGER PRIMARY KEY,
-                        mode TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    CREATE TABLE IF NOT EXISTS analysis_blobs (
+                        hash TEXT PRIMARY KEY,
+                        codec TEXT NOT NULL,
+                        body BLOB NOT NULL,
+                        size INTEGER NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
                 
-                # User events table
+                # Favorites and last analysis tables (bodies live in analysis_blobs)
+                cursor.execute(FAVORITES_TABLE_SQL)
+                cursor.execute(LAST_ANALYSIS_TABLE_SQL)
+                migrated_count = self._migrate_inline_analysis(cursor)
+                
                 cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS user_events (
-                        user_id INTEGER PRIMARY KEY,
-                        event TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
+                    CREATE INDEX IF NOT EXISTS idx_favorites_user_created
+                    ON favorites (user_id, created_at DESC, id DESC)
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_favorites_hash
+                    ON favorites (analysis_hash)
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_last_analysis_hash
+                    ON last_analysis (analysis_hash)
                 """)
+                replaced_search_index = self._create_favorites_search(cursor)
                 
-                # Favorites table
+                # Analysis cache table (keyed by image hash, mode and event)
                 cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS favorites (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
+                    CREATE TABLE IF NOT EXISTS analysis_cache (
+                        cache_key TEXT PRIMARY KEY,
                         analysis TEXT NOT NULL,
-                        mode TEXT NOT NULL DEFAULT 'general',
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
-                
-                # Last analysis table
                 cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS last_analysis (
-                        user_id INTEGER PRIMARY KEY,
-                        analysis TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
+                    CREATE INDEX IF NOT EXISTS idx_analysis_cache_created
+                    ON analysis_cache (created_at)
                 """)
                 
                 conn.commit()
                 
+                if migrated_count or replaced_search_index:
+                    if self.vacuum_after_migration:
+                        # Reclaim the space freed by moving analysis text out of line
+                        cursor.execute("VACUUM")
+                    else:
+                        logger.info("Run VACUUM (or start once with DB_VACUUM_AFTER_MIGRATION=true) "
+                                    "to reclaim the space freed by the migration")
+                
         except sqlite3.Error as e:
             logger.error(f"Database initialization error: {e}")
             raise
 
+    def _migrate_legacy_session_tables(self, cursor: sqlite3.Cursor):
+        """Merge user_states, user_preferences and user_events into user_sessions"""
+        cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name IN ('user_states', 'user_preferences', 'user_events')
+        """)
+        legacy_tables = {row['name'] for row in cursor.fetchall()}
+        if not legacy_tables:
+            return
+        
+        # Create any missing legacy table so the merge query stays simple
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute("CREATE TABLE IF NOT EXISTS user_states (user_id INTEGER PRIMARY KEY, is_active BOOLEAN)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS user_preferences (user_id INTEGER PRIMARY KEY, mode TEXT)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS user_events (user_id INTEGER PRIMARY KEY, event TEXT)")
+            cursor.execute("""
+                INSERT OR IGNORE INTO user_sessions (user_id, is_active, mode, event)
+                SELECT ids.user_id,
+                       COALESCE(s.is_active, FALSE),
+                       p.mode,
+                       e.event
+                FROM (
+                    SELECT user_id FROM user_states
+                    UNION SELECT user_id FROM user_preferences
+                    UNION SELECT user_id FROM user_events
+                ) AS ids
+                LEFT JOIN user_states s ON s.user_id = ids.user_id
+                LEFT JOIN user_preferences p ON p.user_id = ids.user_id
+                LEFT JOIN user_events e ON e.user_id = ids.user_id
+            """)
+            migrated_count = cursor.rowcount
+            cursor.execute("DROP TABLE user_states")
+            cursor.execute("DROP TABLE user_preferences")
+            cursor.execute("DROP TABLE user_events")
+            cursor.execute("COMMIT")
+            logger.info(f"Migrated {migrated_count} users to user_sessions")
+        except sqlite3.Error:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def _create_favorites_search(self, cursor: sqlite3.Cursor) -> bool:
+        """Create the favorites full-text index and index existing favorites.
+
+        Returns True if an older index that kept its own copy of every
+        analysis was replaced, so the caller can reclaim the space.
+        """
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'favorites_fts'")
+        row = cursor.fetchone()
+        # Earlier versions kept the index in sync with triggers on favorites
+        cursor.execute("DROP TRIGGER IF EXISTS favorites_fts_insert")
+        cursor.execute("DROP TRIGGER IF EXISTS favorites_fts_delete")
+        if row is not None and 'content' in row['sql']:
+            return False
+        
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if row is not None:
+                cursor.execute("DROP TABLE favorites_fts")
+            cursor.execute(FAVORITES_FTS_SOURCE_SQL)
+            cursor.execute(FAVORITES_FTS_SQL)
+            cursor.execute("INSERT INTO favorites_fts (favorites_fts) VALUES ('rebuild')")
+            cursor.execute("COMMIT")
+        except sqlite3.Error:
+            cursor.execute("ROLLBACK")
+            raise
+        logger.info("Built the favorites search index")
+        return row is not None
+
+    def _migrate_inline_analysis(self, cursor: sqlite3.Cursor) -> int:
+        """Move analysis text stored inline in favorites/last_analysis to analysis_blobs"""
+        migrated_count = 0
+        for table, columns, create_sql in (
+            ('favorites', 'id, user_id, mode, created_at', FAVORITES_TABLE_SQL),
+            ('last_analysis', 'user_id, created_at, updated_at', LAST_ANALYSIS_TABLE_SQL),
+        ):
+            cursor.execute(f"PRAGMA table_info({table})")
+            if 'analysis' not in {row['name'] for row in cursor.fetchall()}:
+                continue
+            
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_inline")
+                cursor.execute(create_sql)
+                rows = cursor.execute(f"SELECT {columns}, analysis FROM {table}_inline").fetchall()
+                for row in rows:
+                    analysis = row['analysis']
+                    for sql, params in self.analysis_blob_writes(analysis):
+                        cursor.execute(sql, params)
+                    values = [row[name.strip()] for name in columns.split(',')]
+                    cursor.execute(
+                        f"INSERT INTO {table} ({columns}, analysis_hash) VALUES ({', '.join('?' * (len(values) + 1))})",
+                        (*values, analysis_hash(analysis))
+                    )
+                self._copy_sequence(cursor, f"{table}_inline", table)
+                cursor.execute(f"DROP TABLE {table}_inline")
+                cursor.execute("COMMIT")
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK")
+                raise
+            logger.info(f"Moved {len(rows)} {table} rows to analysis_blobs")
+            migrated_count += len(rows)
+        return migrated_count
+
+    @staticmethod
+    def _copy_sequence(cursor: sqlite3.Cursor, source: str, target: str):
+        """Carry an AUTOINCREMENT counter over to a rebuilt table.
+
+        Rows re-inserted with their ids only raise the counter to the highest
+        id still present, so ids of deleted rows could be handed out again.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (source,))
+        old = cursor.fetchone()
+        if old is None:
+            return
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (target,))
+        new = cursor.fetchone()
+        if new is None:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (target, old['seq']))
+        elif new['seq'] < old['seq']:
+            cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (old['seq'], target))
+
+    @staticmethod
+    def analysis_blob_writes(analysis: str) -> List[Tuple[str, tuple]]:
+        """Statements that store an analysis body if it is not stored yet"""
+        codec, body = compress_analysis(analysis)
+        return [("""
+            INSERT OR IGNORE INTO analysis_blobs (hash, codec, body, size)
+            VALUES (?, ?, ?, ?)
+        """, (analysis_hash(analysis), codec, body, len(analysis)))]
+
+    def get_user_session(self, user_id: int) -> Optional[dict]:
+        """Get user state, mode and event in a single query"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT is_active, mode, event FROM user_sessions WHERE user_id = ?",
+                    (user_id,)
+                )
+                result = cursor.fetchone()
+                if not result:
+                    return None
+                return {
+                    'is_active': bool(result['is_active']),
+                    'mode': result['mode'],
+                    'event': result['event']
+                }
+        except sqlite3.Error as e:
+            logger.error(f"Error getting user session: {e}")
+            return None
+
+    @staticmethod
+    def session_writes(user_id: int, is_active: bool, mode: Optional[str],
+                       event: Optional[str]) -> List[Tuple[str, tuple]]:
+        """Statements that save a user session"""
+        return [("""
+            INSERT INTO user_sessions (user_id, is_active, mode, event, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+            is_active = excluded.is_active,
+            mode = excluded.mode,
+            event = excluded.event,
+            updated_at = CURRENT_TIMESTAMP
+        """, (user_id, is_active, mode, event))]
+
+    def save_user_session(self, user_id: int, is_active: bool,
+                          mode: Optional[str], event: Optional[str]) -> bool:
+        """Save user state, mode and event in a single statement"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                for sql, params in self.session_writes(user_id, is_active, mode, event):
+                    cursor.execute(sql, params)
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            logger.error(f"Error saving user session: {e}")
+            return False
+
     def set_user_state(self, user_id: int, is_active: bool) -> bool:
         """Set user state"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    INSERT INTO user_states (user_id, is_active, updated_at)
+                    INSERT INTO user_sessions (user_id, is_active, updated_at)
                     VALUES (?, ?, CURRENT_TIMESTAMP)
                     ON CONFLICT(user_id) DO UPDATE SET
                     is_active = ?,
@@ -138,7 +537,7 @@ class Database:
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT is_active FROM user_states WHERE user_id = ?", (user_id,))
+                cursor.execute("SELECT is_active FROM user_sessions WHERE user_id = ?", (user_id,))
                 result = cursor.fetchone()
                 return bool(result['is_active']) if result else False
         except sqlite3.Error as e:
@@ -151,7 +550,7 @@ class Database:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    INSERT INTO user_preferences (user_id, mode, updated_at)
+                    INSERT INTO user_sessions (user_id, mode, updated_at)
                     VALUES (?, ?, CURRENT_TIMESTAMP)
                     ON CONFLICT(user_id) DO UPDATE SET
                     mode = ?,
@@ -168,7 +567,7 @@ class Database:
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT mode FROM user_preferences WHERE user_id = ?", (user_id,))
+                cursor.execute("SELECT mode FROM user_sessions WHERE user_id = ?", (user_id,))
                 result = cursor.fetchone()
                 return result['mode'] if result else None
         except sqlite3.Error as e:
@@ -181,7 +580,7 @@ class Database:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    INSERT INTO user_events (user_id, event, updated_at)
+                    INSERT INTO user_sessions (user_id, event, updated_at)
                     VALUES (?, ?, CURRENT_TIMESTAMP)
                     ON CONFLICT(user_id) DO UPDATE SET
                     event = ?,
@@ -198,7 +597,7 @@ class Database:
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT event FROM user_events WHERE user_id = ?", (user_id,))
+                cursor.execute("SELECT event FROM user_sessions WHERE user_id = ?", (user_id,))
                 result = cursor.fetchone()
                 return result['event'] if result else None
         except sqlite3.Error as e:
@@ -210,43 +609,190 @@ class Database:
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
+                content_hash = analysis_hash(analysis)
+                cursor.execute("BEGIN IMMEDIATE")
+                for sql, params in self.analysis_blob_writes(analysis):
+                    cursor.execute(sql, params)
+                # Saving the same analysis twice keeps a single favorite
                 cursor.execute("""
-                    INSERT INTO favorites (user_id, analysis, mode)
-                    VALUES (?, ?, ?)
-                """, (user_id, analysis, mode))
-                conn.commit()
+                    INSERT INTO favorites (user_id, analysis_hash, mode)
+                    SELECT ?, ?, ?
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM favorites WHERE analysis_hash = ? AND user_id = ?
+                    )
+                    RETURNING id
+                """, (user_id, content_hash, mode, content_hash, user_id))
+                inserted = cursor.fetchone()
+                if inserted is not None:
+                    cursor.execute(FAVORITES_FTS_INSERT_SQL, (inserted['id'], analysis, mode, f"u{user_id}"))
+                cursor.execute("COMMIT")
                 return True
         except sqlite3.Error as e:
             logger.error(f"Error adding favorite: {e}")
             return False
 
+    @staticmethod
+    def _favorite_row(row: sqlite3.Row) -> Tuple[int, str, str, str]:
+        return (row['id'], decompress_analysis(row['codec'], row['body']), row['mode'], row['created_at'])
+
     def get_user_favorites(self, user_id: int) -> List[Tuple[int, str, str, str]]:
         """Get user favorites"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT id, analysis, mode, created_at
-                    FROM favorites
-                    WHERE user_id = ?
-                    ORDER BY created_at DESC
+                    SELECT f.id, b.codec, b.body, f.mode, f.created_at
+                    FROM favorites f
+                    JOIN analysis_blobs b ON b.hash = f.analysis_hash
+                    WHERE f.user_id = ?
+                    ORDER BY f.created_at DESC
                 """, (user_id,))
-                return [(row['id'], row['analysis'], row['mode'], row['created_at']) for row in cursor.fetchall()]
+                return [self._favorite_row(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
             logger.error(f"Error getting favorites: {e}")
             return []
 
+    def get_favorites_page(self, user_id: int, limit: int,
+                           cursor: Optional[Tuple[str, int]] = None,
+                           direction: str = 'next') -> Tuple[List[Tuple[int, str, str, str]], int]:
+        """Get one page of user favorites (newest first) and the total count.
+
+        cursor is the (created_at, id) of a favorite on the page being shown;
+        direction 'next' returns the page after it, 'prev' the page before it
+        and 'current' the page starting at it.
+        """
+        try:
+            with self.get_connection() as conn:
+                db_cursor = conn.cursor()
+                if cursor is None:
+                    db_cursor.execute("""
+                        SELECT f.id, b.codec, b.body, f.mode, f.created_at
+                        FROM favorites f
+                        JOIN analysis_blobs b ON b.hash = f.analysis_hash
+                        WHERE f.user_id = ?
+                        ORDER BY f.created_at DESC, f.id DESC
+                        LIMIT ?
+                    """, (user_id, limit))
+                    rows = db_cursor.fetchall()
+                elif direction == 'prev':
+                    db_cursor.execute("""
+                        SELECT f.id, b.codec, b.body, f.mode, f.created_at
+                        FROM favorites f
+                        JOIN analysis_blobs b ON b.hash = f.analysis_hash
+                        WHERE f.user_id = ? AND (f.created_at, f.id) > (?, ?)
+                        ORDER BY f.created_at ASC, f.id ASC
+                        LIMIT ?
+                    """, (user_id, cursor[0], cursor[1], limit))
+                    rows = db_cursor.fetchall()[::-1]
+                else:
+                    operator = '<=' if direction == 'current' else '<'
+                    db_cursor.execute(f"""
+                        SELECT f.id, b.codec, b.body, f.mode, f.created_at
+                        FROM favorites f
+                        JOIN analysis_blobs b ON b.hash = f.analysis_hash
+                        WHERE f.user_id = ? AND (f.created_at, f.id) {operator} (?, ?)
+                        ORDER BY f.created_at DESC, f.id DESC
+                        LIMIT ?
+                    """, (user_id, cursor[0], cursor[1], limit))
+                    rows = db_cursor.fetchall()
+                
+                db_cursor.execute("SELECT COUNT(*) FROM favorites WHERE user_id = ?", (user_id,))
+                total_count = db_cursor.fetchone()[0]
+                return [self._favorite_row(row) for row in rows], total_count
+        except sqlite3.Error as e:
+            logger.error(f"Error getting favorites page: {e}")
+            return [], 0
+
+    def export_favorites(self, user_id: int, write: Callable[[List[Tuple[int, str, str, str]]], None],
+                         batch_size: int = 100) -> int:
+        """Stream all user favorites (newest first) to write() in batches.
+
+        Rows are fetched from one cursor with fetchmany(), so only a single
+        batch is in memory at a time. Returns the number of favorites written.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT f.id, b.codec, b.body, f.mode, f.created_at
+                    FROM favorites f
+                    JOIN analysis_blobs b ON b.hash = f.analysis_hash
+                    WHERE f.user_id = ?
+                    ORDER BY f.created_at DESC, f.id DESC
+                """, (user_id,))
+                count = 0
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    write([self._favorite_row(row) for row in rows])
+                    count += len(rows)
+                return count
+        except sqlite3.Error as e:
+            logger.error(f"Error exporting favorites: {e}")
+            raise
+
+    def search_favorites(self, user_id: int, terms: str, limit: int = 10) -> List[Tuple[int, str, str, str]]:
+        """Search user favorites, best match first.
+
+        Returns (id, snippet, mode, created_at) rows; the snippet is a short
+        excerpt of the analysis with the matched words in «». The owner
+        token restricts the match to the user's favorites inside the index;
+        bm25 ranking still uses statistics of all favorites.
+        """
+        match = favorites_match_query(terms)
+        if match is None:
+            return []
+        query = f'owner : "u{int(user_id)}" AND {{analysis mode}} : ({match})'
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT f.id,
+                           snippet(favorites_fts, 0, '«', '»', '…', 24) AS snippet,
+                           f.mode, f.created_at
+                    FROM favorites_fts
+                    JOIN favorites f ON f.id = favorites_fts.rowid
+                    WHERE favorites_fts MATCH ?
+                    ORDER BY favorites_fts.rank
+                    LIMIT ?
+                """, (query, limit))
+                return [(row['id'], row['snippet'], row['mode'], row['created_at']) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error searching favorites: {e}")
+            return []
+
+    @staticmethod
+    def _unindex_favorites(cursor: sqlite3.Cursor, deleted: List[sqlite3.Row]):
+        """Remove deleted favorites from the search index; call before their blobs go"""
+        texts = {}
+        for row in deleted:
+            content_hash = row['analysis_hash']
+            if content_hash not in texts:
+                cursor.execute("SELECT codec, body FROM analysis_blobs WHERE hash = ?", (content_hash,))
+                blob = cursor.fetchone()
+                texts[content_hash] = decompress_analysis(blob['codec'], blob['body'])
+        cursor.executemany(FAVORITES_FTS_DELETE_SQL, [
+            (row['id'], texts[row['analysis_hash']], row['mode'], f"u{row['user_id']}") for row in deleted
+        ])
+
     def delete_favorite(self, favorite_id: int, user_id: int) -> bool:
         """Delete favorite"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
                 cursor.execute("""
                     DELETE FROM favorites
                     WHERE id = ? AND user_id = ?
+                    RETURNING id, user_id, analysis_hash, mode
                 """, (favorite_id, user_id))
-                conn.commit()
-                return cursor.rowcount > 0
+                deleted = cursor.fetchall()
+                self._unindex_favorites(cursor, deleted)
+                deleted_hashes = [(row['analysis_hash'],) for row in deleted]
+                cursor.executemany(DELETE_ORPHAN_BLOB_SQL, deleted_hashes)
+                cursor.execute("COMMIT")
+                return len(deleted_hashes) > 0
         except sqlite3.Error as e:
             logger.error(f"Error deleting favorite: {e}")
             return False
@@ -256,40 +802,145 @@ class Database:
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("DELETE FROM favorites WHERE user_id = ?", (user_id,))
-                deleted_count = cursor.rowcount
-                conn.commit()
-                return deleted_count
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("""
+                    DELETE FROM favorites
+                    WHERE user_id = ?
+                    RETURNING id, user_id, analysis_hash, mode
+                """, (user_id,))
+                deleted = cursor.fetchall()
+                self._unindex_favorites(cursor, deleted)
+                deleted_hashes = [(row['analysis_hash'],) for row in deleted]
+                cursor.executemany(DELETE_ORPHAN_BLOB_SQL, set(deleted_hashes))
+                cursor.execute("COMMIT")
+                return len(deleted_hashes)
         except sqlite3.Error as e:
             logger.error(f"Error deleting all favorites: {e}")
             return 0
 
+    @staticmethod
+    def last_analysis_writes(user_id: int, analysis: str) -> List[Tuple[str, tuple]]:
+        """Statements that save the last analysis"""
+        content_hash = analysis_hash(analysis)
+        return Database.analysis_blob_writes(analysis) + [
+            # Drop the previous body unless something else still refers to it
+            ("""
+                DELETE FROM analysis_blobs
+                WHERE hash = (SELECT analysis_hash FROM last_analysis WHERE user_id = ?)
+                AND hash != ?
+                AND NOT EXISTS (SELECT 1 FROM favorites WHERE analysis_hash = analysis_blobs.hash)
+                AND NOT EXISTS (
+                    SELECT 1 FROM last_analysis
+                    WHERE analysis_hash = analysis_blobs.hash AND user_id != ?
+                )
+            """, (user_id, content_hash, user_id)),
+            ("""
+                INSERT INTO last_analysis (user_id, analysis_hash, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id) DO UPDATE SET
+                analysis_hash = excluded.analysis_hash,
+                updated_at = CURRENT_TIMESTAMP
+            """, (user_id, content_hash)),
+        ]
+
     def save_last_analysis(self, user_id: int, analysis: str) -> bool:
         """Save last analysis"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO last_analysis (user_id, analysis, updated_at)
-                    VALUES (?, ?, CURRENT_TIMESTAMP)
-                    ON CONFLICT(user_id) DO UPDATE SET
-                    analysis = ?,
-                    updated_at = CURRENT_TIMESTAMP
-                """, (user_id, analysis, analysis))
-                conn.commit()
+                cursor.execute("BEGIN IMMEDIATE")
+                for sql, params in self.last_analysis_writes(user_id, analysis):
+                    cursor.execute(sql, params)
+                cursor.execute("COMMIT")
                 return True
         except sqlite3.Error as e:
             logger.error(f"Error saving last analysis: {e}")
             return False
 
+    def write_batch(self, writes: List[Tuple[str, tuple]]) -> bool:
+        """Apply several writes in a single transaction"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                for sql, params in writes:
+                    cursor.execute(sql, params)
+                cursor.execute("COMMIT")
+                return True
+        except sqlite3.Error as e:
+            logger.error(f"Error writing batch: {e}")
+            return False
+
     def get_last_analysis(self, user_id: int) -> Optional[str]:
         """Get last analysis"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT analysis FROM last_analysis WHERE user_id = ?", (user_id,))
+                cursor.execute("""
+                    SELECT b.codec, b.body
+                    FROM last_analysis l
+                    JOIN analysis_blobs b ON b.hash = l.analysis_hash
+                    WHERE l.user_id = ?
+                """, (user_id,))
                 result = cursor.fetchone()
-                return result['analysis'] if result else None
+                return decompress_analysis(result['codec'], result['body']) if result else None
         except sqlite3.Error as e:
             logger.error(f"Error getting last analysis: {e}")
-            return None 
\ No newline at end of file
+            return None
+
+    def get_cached_analysis(self, cache_key: str, ttl: int) -> Optional[str]:
+        """Get cached analysis if it is younger than ttl seconds"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT analysis FROM analysis_cache
+                    WHERE cache_key = ? AND created_at > datetime('now', ?)
+                """, (cache_key, f"-{int(ttl)} seconds"))
+                result = cursor.fetchone()
+                return result['analysis'] if result else None
+        except sqlite3.Error as e:
+            logger.error(f"Error getting cached analysis: {e}")
+            return None
+
+    def save_cached_analysis(self, cache_key: str, analysis: str) -> bool:
+        """Save analysis to cache"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO analysis_cache (cache_key, analysis, created_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(cache_key) DO UPDATE SET
+                    analysis = ?,
+                    created_at = CURRENT_TIMESTAMP
+                """, (cache_key, analysis, analysis))
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            logger.error(f"Error saving cached analysis: {e}")
+            return False
+
+    def prune_analysis_cache(self, max_entries: int, ttl: int) -> int:
+        """Delete expired cache entries and the oldest ones beyond max_entries"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "DELETE FROM analysis_cache WHERE created_at <= datetime('now', ?)",
+                    (f"-{int(ttl)} seconds",)
+                )
+                deleted_count = cursor.rowcount
+                cursor.execute("""
+                    DELETE FROM analysis_cache WHERE cache_key IN (
+                        SELECT cache_key FROM analysis_cache
+                        ORDER BY created_at DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                """, (max_entries,))
+                deleted_count += cursor.rowcount
+                conn.commit()
+                return deleted_count
+        except sqlite3.Error as e:
+            logger.error(f"Error pruning analysis cache: {e}")
+            return 0
@@ -1,4 +1,6 @@
 import logging
+from typing import Optional
+import metrics
 from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.error import (
@@ -9,17 +11,19 @@ from telegram.error import (
     TimedOut
 )
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def describe_update(update: object) -> str:
+    """Short identification of an update for log lines, instead of its full repr"""
+    if not isinstance(update, Update):
+        return type(update).__name__
+    user_id = update.effective_user.id if update.effective_user else None
+    kind = next(
+        (name for name in ('message', 'callback_query', 'edited_message') if getattr(update, name)),
+        'other'
+    )
+    return f"update {update.update_id} ({kind}) from user {user_id}"
+
 class ErrorHandler:
     def __init__(self):
         self.error_messages = {
@@ -34,6 +38,7 @@ class ErrorHandler:
     
     async def send_error_message(self, update: Update, error_type: str = 'general'):
         """Send error message based on update type"""
+        metrics.inc('bot_errors_total', category=error_type)
         try:
             message = self.error_messages.get(error_type, self.error_messages['general'])
             
@@ -49,10 +54,11 @@ class ErrorHandler:
         except Exception as e:
             logger.error(f"Error sending error message: {str(e)}")
     
-    async def handle_error(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """General error handler"""
+    async def handle_error(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                           error: Optional[Exception] = None):
+        """General error handler; error defaults to context.error"""
         try:
-            error = context.error
+            error = error or context.error
             
             if isinstance(error, (NetworkError, TimedOut)):
                 await self.handle_network_error(update, error)
@@ -61,7 +67,7 @@ class ErrorHandler:
             elif isinstance(error, Forbidden):
                 await self.handle_forbidden_error(update, error)
             else:
-                logger.error(f"Update {update} caused error: {str(error)}")
+                logger.error(f"{describe_update(update)} caused error: {str(error)}", exc_info=error)
                 await self.send_error_message(update)
                 
         except Exception as e:
@@ -77,6 +83,11 @@ class ErrorHandler:
         logger.error(f"API error: {str(error)}")
         await self.send_error_message(update, 'api')
     
+    async def handle_timeout_error(self, update: Update, error: Exception):
+        """Timeout error handler"""
+        logger.error(f"Timeout error: {str(error)}")
+        await self.send_error_message(update, 'timeout')
+    
     async def handle_network_error(self, update: Update, error: Exception):
         """Network error handler"""
         logger.error(f"Network error: {str(error)}")
@@ -0,0 +1,49 @@
+import gzip
+import json
+from typing import IO, List, Tuple
+
+EXPORT_FORMATS = ('txt', 'json', 'md')
+
+class FavoritesExport:
+    """Write favorites to a gzip-compressed file one batch at a time.
+
+    Only the batch being written is held in memory, so exports of any size
+    use the same amount of memory. Formats are plain text, a JSON array and
+    Markdown.
+    """
+
+    def __init__(self, path: str, fmt: str = 'txt', compresslevel: int = 6):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        self.fmt = fmt
+        self.count = 0
+        self._file: IO[str] = gzip.open(path, 'wt', encoding='utf-8', compresslevel=compresslevel)
+        if fmt == 'json':
+            self._file.write('[')
+        elif fmt == 'md':
+            self._file.write("# Favorite Outfits\n")
+
+    def write(self, favorites: List[Tuple[int, str, str, str]]):
+        """Append a batch of (id, analysis, mode, created_at) rows"""
+        for fav_id, analysis, mode, created_at in favorites:
+            if self.fmt == 'json':
+                entry = {'id': fav_id, 'mode': mode, 'created_at': created_at, 'analysis': analysis}
+                self._file.write(',\n' if self.count else '\n')
+                self._file.write(json.dumps(entry, ensure_ascii=False))
+            elif self.fmt == 'md':
+                self._file.write(f"\n## Favorite {fav_id} ({mode.title()})\n\n*{created_at}*\n\n{analysis}\n")
+            else:
+                self._file.write(f"Favorite ID: {fav_id}\nDate: {created_at}\nMode: {mode.title()}\n")
+                self._file.write(f"Analysis:\n{analysis}\n{'─' * 30}\n")
+            self.count += 1
+
+    def close(self):
+        if self.fmt == 'json':
+            self._file.write('\n]\n')
+        self._file.close()
+
+    def __enter__(self) -> "FavoritesExport":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
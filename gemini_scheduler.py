@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Deque, Optional, Set, TypeVar
+import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+class _Request:
+    def __init__(self, future: asyncio.Future, on_position: Optional[PositionCallback]):
+        self.future = future
+        self.on_position = on_position
+        self.position: Optional[int] = None
+        self.notified_at = 0.0
+
+class GeminiScheduler:
+    """Fair, rate-limited admission control for Gemini calls.
+
+    Requests wait in one FIFO queue per user and are admitted round-robin
+    across users, so a user sending dozens of photos only delays their own
+    photos. Admission also needs a token from the quota bucket and a free
+    in-flight slot.
+    """
+
+    def __init__(self, rate_per_minute: float = 60, burst: int = 10,
+                 max_in_flight: int = 8, position_update_interval: float = 3.0):
+        self.bucket = TokenBucket(rate_per_minute / 60, burst)
+        self.max_in_flight = max_in_flight
+        self.position_update_interval = position_update_interval
+        self._queues: "OrderedDict[int, Deque[_Request]]" = OrderedDict()
+        self._in_flight = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def run(self, user_id: int, func: Callable[[], Awaitable[T]],
+                  on_position: Optional[PositionCallback] = None) -> T:
+        """Wait for this user's turn, then await func()"""
+        loop = asyncio.get_running_loop()
+        request = _Request(loop.create_future(), on_position)
+        self._queues.setdefault(user_id, deque()).append(request)
+        self._dispatch()
+
+        try:
+            with metrics.timer('bot_gemini_queue_seconds'):
+                await request.future
+        except asyncio.CancelledError:
+            self._remove(user_id, request)
+            self._dispatch()
+            raise
+
+        try:
+            return await func()
+        finally:
+            self._in_flight -= 1
+            self._dispatch()
+
+    def hold_slot(self, future: Future):
+        """Keep an in-flight slot taken until future is done.
+
+        For work that outlives the call it was admitted for, such as a worker
+        thread still running after its caller timed out. Without it new calls
+        would be admitted and queue behind that thread.
+        """
+        loop = asyncio.get_running_loop()
+        self._in_flight += 1
+
+        def release():
+            self._in_flight -= 1
+            self._dispatch()
+
+        def on_done(_):
+            try:
+                loop.call_soon_threadsafe(release)
+            except RuntimeError:
+                pass  # The loop is already closed
+
+        future.add_done_callback(on_done)
+
+    def _remove(self, user_id: int, request: _Request):
+        queue = self._queues.get(user_id)
+        if queue and request in queue:
+            queue.remove(request)
+            if not queue:
+                del self._queues[user_id]
+        elif request.future.done() and not request.future.cancelled():
+            # Admitted just before cancellation: give the slot back
+            self._in_flight -= 1
+
+    def _dispatch(self):
+        """Admit as many queued requests as the limits allow"""
+        while self._queues and self._in_flight < self.max_in_flight:
+            wait = self.bucket.wait_time()
+            if wait > 0:
+                if self._timer is None:
+                    loop = asyncio.get_running_loop()
+                    self._timer = loop.call_later(wait, self._on_timer)
+                break
+
+            # Take the head of the first user's queue, then move that user to the back
+            user_id, queue = next(iter(self._queues.items()))
+            request = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+
+            if request.future.done():
+                continue
+            self.bucket.consume()
+            self._in_flight += 1
+            request.future.set_result(None)
+
+        self._update_positions()
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _update_positions(self):
+        """Tell waiting requests their place in the round-robin order"""
+        now = time.monotonic()
+        position = 0
+        depth = 0
+        queues = list(self._queues.values())
+        while queues:
+            for queue in queues:
+                position += 1
+                request = queue[depth]
+                if (request.on_position is not None and request.position != position
+                        and now - request.notified_at >= self.position_update_interval):
+                    request.position = position
+                    request.notified_at = now
+                    self._notify(request.on_position, position)
+            depth += 1
+            queues = [queue for queue in queues if len(queue) > depth]
+
+    def _notify(self, callback: PositionCallback, position: int):
+        task = asyncio.ensure_future(self._safe_notify(callback, position))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _safe_notify(callback: PositionCallback, position: int):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.warning(f"Could not send queue position update: {e}")
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+from image_processing import ProcessedImage
+
+logger = logging.getLogger(__name__)
+
+# First line of every cache file: magic, MIME type and perceptual hash
+_MAGIC = b'OBIMG1'
+
+class ImageDiskCache:
+    """Preprocessed photos on disk, keyed by Telegram's file_unique_id.
+
+    A hit skips get_file(), the download and preprocessing. Each entry is
+    one file holding a short header line and the re-encoded image. Files
+    are written to a temporary name and renamed into place, so readers
+    never see a partial file. They are read through mmap.
+
+    The directory is capped at max_bytes. Least recently used files are
+    removed first; a hit updates the file's mtime, so the order survives
+    restarts. max_bytes=0 disables the cache.
+    """
+
+    def __init__(self, directory: str = 'image_cache', max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._files: "OrderedDict[str, int]" = OrderedDict()  # file name: size, oldest first
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _load_index(self):
+        """Rebuild the LRU order from the files left by a previous run"""
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith('.tmp'):
+                    # Left behind by a write that never finished
+                    os.remove(entry.path)
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    @staticmethod
+    def _file_name(key: str) -> str:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+    def _evict(self):
+        """Remove least recently used files until the cache fits; call with the lock held"""
+        while self.total_bytes > self.max_bytes and self._files:
+            name, size = self._files.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, name: str):
+        with self._lock:
+            size = self._files.pop(name, None)
+            if size is not None:
+                self.total_bytes -= size
+
+    def _read(self, key: str) -> Optional[ProcessedImage]:
+        name = self._file_name(key)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                header_end = view.find(b'\n')
+                magic, mime_type, phash = bytes(view[:header_end]).split(b' ')
+                if magic != _MAGIC:
+                    raise ValueError("unknown cache file format")
+                image = ProcessedImage(view[header_end + 1:], mime_type.decode('ascii'), phash.decode('ascii'))
+        except FileNotFoundError:
+            self._forget(name)
+            return None
+        except (OSError, ValueError) as e:
+            # Truncated or foreign file: drop it and treat it as a miss
+            logger.warning(f"Discarding unreadable image cache file {name}: {e}")
+            self._forget(name)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        with self._lock:
+            if name in self._files:
+                self._files.move_to_end(name)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return image
+
+    def _write(self, key: str, image: ProcessedImage):
+        name = self._file_name(key)
+        header = b' '.join((_MAGIC, image.mime_type.encode('ascii'), image.phash.encode('ascii'))) + b'\n'
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(header)
+                file.write(image.data)
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        size = len(header) + len(image.data)
+        with self._lock:
+            self.total_bytes += size - self._files.pop(name, 0)
+            self._files[name] = size
+            self._evict()
+
+    async def get(self, key: str) -> Optional[ProcessedImage]:
+        """Cached image for key, or None"""
+        if not self.enabled:
+            return None
+        image = await asyncio.to_thread(self._read, key)
+        if image is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return image
+
+    async def put(self, key: str, image: ProcessedImage):
+        """Store an image; failures are logged and otherwise ignored"""
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._write, key, image)
+        except OSError as e:
+            logger.warning(f"Could not write image cache file: {e}")
@@ -0,0 +1,148 @@
+import asyncio
+import functools
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple, Optional, Sequence, Tuple
+from PIL import Image, ImageOps
+from telegram import PhotoSize
+
+logger = logging.getLogger(__name__)
+
+# Resolution images are reduced to before analysis
+ANALYSIS_SIZE = (800, 800)
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+class ProcessedImage(NamedTuple):
+    """Compact re-encoded image ready to send to Gemini"""
+    data: bytes
+    mime_type: str
+    phash: str
+
+    def as_blob(self) -> dict:
+        """Inline image part for generate_content"""
+        return {'mime_type': self.mime_type, 'data': self.data}
+
+def select_photo_size(photos: Sequence[PhotoSize], target: Tuple[int, int] = ANALYSIS_SIZE) -> PhotoSize:
+    """Pick the smallest photo variant that still covers the analysis resolution.
+
+    Thumbnailing fits an image inside target, so a variant covers it as soon
+    as one side reaches the box; anything larger is downloaded for nothing.
+    """
+    by_area = sorted(photos, key=lambda photo: photo.width * photo.height)
+    for photo in by_area:
+        if photo.width >= target[0] or photo.height >= target[1]:
+            return photo
+    return by_area[-1]
+
+def load_image(data: bytes, max_size: Tuple[int, int] = ANALYSIS_SIZE) -> Image.Image:
+    """Decode photo bytes, fix EXIF orientation and reduce the image to fit max_size"""
+    image = Image.open(io.BytesIO(data))
+    if image.format == 'JPEG':
+        # Let the JPEG decoder scale down by a power of two while decoding
+        image.draft('RGB', max_size)
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(max_size, Image.Resampling.LANCZOS)
+    return image
+
+def perceptual_hash(image: Image.Image) -> str:
+    """Difference hash (dHash) of an image as a 16 character hex string.
+
+    Re-encoded or slightly recompressed copies of the same photo produce the
+    same hash, unlike a hash of the raw bytes.
+    """
+    small = image.convert('L').resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return f"{bits:016x}"
+
+def preprocess_image(data: bytes, max_size: Tuple[int, int] = ANALYSIS_SIZE,
+                     image_format: str = 'JPEG', quality: int = 85) -> ProcessedImage:
+    """Resize, orient and re-encode photo bytes without metadata.
+
+    Runs in a worker process, so it must stay a module-level function.
+    """
+    image = load_image(data, max_size)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    output = io.BytesIO()
+    # No exif/icc arguments are passed, so metadata is stripped
+    image.save(output, format=image_format, quality=quality, optimize=True)
+    return ProcessedImage(output.getvalue(), MIME_TYPES[image_format], perceptual_hash(image))
+
+class ImagePreprocessor:
+    def __init__(self, workers: Optional[int] = None, max_size: Tuple[int, int] = ANALYSIS_SIZE,
+                 image_format: str = 'JPEG', quality: int = 85):
+        self.workers = workers
+        self.max_size = max_size
+        self.image_format = image_format.upper()
+        self.quality = quality
+        if self.image_format not in MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        """Create the worker pool on first use"""
+        if self._executor is None:
+            if self.workers == 0:
+                # Debug mode: preprocess on a single thread in this process
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image")
+            else:
+                # Fork avoids re-running main.py in every worker. spawn
+                # would re-import it, opening the database once per worker.
+                start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(start_method)
+                )
+        return self._executor
+
+    def start(self):
+        """Start the worker processes.
+
+        Call this before the bot starts any threads: forking a process that
+        already runs threads can deadlock the children.
+        """
+        executor = self._get_executor()
+        if isinstance(executor, ProcessPoolExecutor):
+            # With fork the whole pool is started on the first submit
+            executor.submit(os.getpid).result()
+
+    async def process(self, data: bytes) -> ProcessedImage:
+        """Preprocess downloaded photo bytes in the worker pool"""
+        loop = asyncio.get_running_loop()
+        job = functools.partial(preprocess_image, bytes(data), self.max_size, self.image_format, self.quality)
+        executor = self._get_executor()
+        try:
+            return await loop.run_in_executor(executor, job)
+        except BrokenProcessPool:
+            # A worker died (for example killed by the OOM killer). Forking a
+            # new pool from the running bot could deadlock (see start()), so
+            # preprocess on threads in this process from now on
+            if self._executor is executor:
+                logger.error("Image worker pool is broken, preprocessing on threads from now on")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers or os.cpu_count() or 1,
+                    thread_name_prefix="image"
+                )
+            return await loop.run_in_executor(self._executor, job)
+
+    def shutdown(self):
+        """Stop the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,155 @@
+import atexit
+import contextlib
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Optional
+
+# Id of the update being handled; copied into threads with contextvars.copy_context()
+trace_id: contextvars.ContextVar[str] = contextvars.ContextVar('trace_id', default='-')
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def new_trace_id() -> str:
+    """Start a new trace for the current context and return its id"""
+    value = uuid.uuid4().hex[:16]
+    trace_id.set(value)
+    return value
+
+class TraceIdFilter(logging.Filter):
+    """Stamp records with the current trace id.
+
+    Runs in the thread that logs, before the record is queued, so the id
+    comes from the caller's context rather than the listener thread.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of INFO and lower records; warnings always pass.
+
+    Sampling is decided per trace id, so a sampled update keeps all of its
+    lines instead of a random subset.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        current = getattr(record, 'trace_id', '-')
+        if current == '-':
+            return random.random() < self.rate
+        return zlib.crc32(current.encode('ascii')) / 0xFFFFFFFF < self.rate
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'trace_id': getattr(record, 'trace_id', '-'),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Make the record safe to queue but keep message and traceback apart.
+
+        The stock prepare() formats the traceback into the message, which
+        would hide it from the JSON 'exception' field.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging(path: str = 'bot.log', level: str = 'INFO', json_format: bool = True,
+                  max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                  sample_rate: float = 1.0):
+    """Route all logging through a queue to a background writer thread.
+
+    Log calls only put the record on a queue; a listener thread writes it to
+    a rotating file and to stderr. Calling this again replaces the previous
+    setup, e.g. in a worker process that logs to its own file.
+    """
+    global _listener
+    stop_logging()
+
+    if json_format:
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s')
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(TraceIdFilter())
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+    _listener.start()
+
+def stop_logging():
+    """Write out queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+@contextlib.contextmanager
+def writer_thread_stopped():
+    """Stop the listener thread for the duration of the block.
+
+    For forking worker processes, which must not happen while other threads
+    run. Records logged meanwhile wait in the queue and are written once
+    the thread is started again.
+    """
+    listener = _listener
+    if listener is None:
+        yield
+        return
+    listener.stop()
+    try:
+        yield
+    finally:
+        listener.start()
+
+atexit.register(stop_logging)
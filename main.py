@@ -1,30 +1,31 @@
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, ConversationHandler
-from PIL import Image
-import io
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, File, PhotoSize
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ContextTypes, ConversationHandler
 import logging
-from database import Database
+from async_database import AsyncDatabase
 from error_handler import ErrorHandler
-from quick_actions import QuickActions
+from quick_actions import QuickActions, LastAnalysisStore
+from analysis_engine import AnalysisEngine
+from gemini_scheduler import GeminiScheduler
+from analysis_cache import AnalysisCache, normalize_event
+from image_processing import ImagePreprocessor, ProcessedImage, select_photo_size
+from image_cache import ImageDiskCache
+from progressive_message import MAX_MESSAGE_LENGTH, ProgressiveMessage
+from multi_mode import MULTI_MODES, build_multi_mode_prompt, parse_multi_mode_response
+from workers import UserLocks, UserOrderedUpdateProcessor, WorkerPool, serve_queue
+from albums import AlbumCollector, build_album_prompt
+from single_flight import SingleFlight
+from logging_setup import new_trace_id, setup_logging, writer_thread_stopped
+from favorites_export import EXPORT_FORMATS
+import metrics
+import asyncio
+import signal
 import sqlite3
+import tempfile
+from typing import List, Optional
 
-# Initialize database and helper classes
-db = Database()
-error_handler = ErrorHandler()
-quick_actions = QuickActions(db)
-
-# Logging settings
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
 # Conversation states
@@ -68,6 +69,8 @@ FAQ = """
 3. How can I use favorites?
    • Use /save command to save an outfit
    • Use /favorites to view your saved outfits
+   • Use /search_favorites <words> to find a saved outfit
+   • Use /export to download all of them as one file
 
 4. How can I change the mode?
    • Use the "Change Mode" button
@@ -78,14 +81,136 @@ FAQ = """
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+# Alternative API servers, e.g. a local Bot API server or the load test fakes
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT')
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '60'))
+GEMINI_RATE_PER_MINUTE = float(os.getenv('GEMINI_RATE_PER_MINUTE', '60'))
+GEMINI_BURST = int(os.getenv('GEMINI_BURST', '10'))
+GEMINI_STREAM = os.getenv('GEMINI_STREAM', 'true').lower() == 'true'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.5'))
+MULTI_MODE_ANALYSIS = os.getenv('MULTI_MODE_ANALYSIS', 'false').lower() == 'true'
+ALBUM_WINDOW = float(os.getenv('ALBUM_WINDOW', '1.0'))
+TRANSPORT = os.getenv('TRANSPORT', 'polling').lower()
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '0'))
+WORKER_CHECK_INTERVAL = float(os.getenv('WORKER_CHECK_INTERVAL', '2'))
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '256'))
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_ADDRESS = os.getenv('METRICS_ADDRESS', '127.0.0.1')
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_MAX_MB = int(os.getenv('LOG_MAX_MB', '10'))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+
+# Set by WorkerPool in bot worker processes, which import this module before
+# run_worker() runs: the log file, image cache and Gemini limits built below
+# are then that worker's own, or its share of the configured totals
+WORKER_INDEX = os.getenv('BOT_WORKER_INDEX')
+WORKER_SHARE = BOT_WORKERS if WORKER_INDEX is not None else 1
+# Rotating one file from several processes would race, so each worker has its own
+if WORKER_INDEX is not None:
+    LOG_FILE = f"{LOG_FILE}.worker{WORKER_INDEX}"
+
+def configure_logging(path: str = LOG_FILE):
+    """Set up queued, rotating, structured logging from the LOG_* settings"""
+    setup_logging(
+        path,
+        level=LOG_LEVEL,
+        json_format=LOG_FORMAT == 'json',
+        max_bytes=LOG_MAX_MB * 1024 * 1024,
+        backup_count=LOG_BACKUP_COUNT,
+        sample_rate=LOG_SAMPLE_RATE
+    )
+
+configure_logging()
+ANALYSIS_CACHE_SIZE = int(os.getenv('ANALYSIS_CACHE_SIZE', '1024'))
+ANALYSIS_CACHE_DB_SIZE = int(os.getenv('ANALYSIS_CACHE_DB_SIZE', '10000'))
+ANALYSIS_CACHE_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', '86400'))
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'bot_data.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_VACUUM_AFTER_MIGRATION = os.getenv('DB_VACUUM_AFTER_MIGRATION', 'false').lower() == 'true'
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '10000'))
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv('WRITE_BEHIND_INTERVAL_MS', '50'))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '100'))
+LAST_ANALYSIS_CACHE_MB = int(os.getenv('LAST_ANALYSIS_CACHE_MB', '32'))
+LAST_ANALYSIS_TTL = int(os.getenv('LAST_ANALYSIS_TTL', '3600'))
+LAST_ANALYSIS_COMPRESS = os.getenv('LAST_ANALYSIS_COMPRESS', 'true').lower() == 'true'
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', str(os.cpu_count() or 1)))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'JPEG')
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', 'image_cache')
+IMAGE_CACHE_MB = int(os.getenv('IMAGE_CACHE_MB', '256'))
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', '5'))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '100'))
+
+# Initialize database and helper classes
+db = AsyncDatabase(
+    DATABASE_PATH,
+    readers=DB_POOL_SIZE,
+    vacuum_after_migration=DB_VACUUM_AFTER_MIGRATION,
+    session_cache_size=SESSION_CACHE_SIZE,
+    flush_interval=WRITE_BEHIND_INTERVAL_MS / 1000,
+    max_pending_writes=WRITE_BEHIND_MAX_PENDING
+)
+error_handler = ErrorHandler()
+quick_actions = QuickActions(db, LastAnalysisStore(
+    db,
+    max_bytes=LAST_ANALYSIS_CACHE_MB * 1024 * 1024,
+    ttl=LAST_ANALYSIS_TTL,
+    compress=LAST_ANALYSIS_COMPRESS
+))
 
 # Gemini API configuration
-genai.configure(api_key=GEMINI_API_KEY)
+if GEMINI_API_ENDPOINT:
+    genai.configure(api_key=GEMINI_API_KEY, transport='rest',
+                    client_options={'api_endpoint': GEMINI_API_ENDPOINT})
+else:
+    genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel('gemini-1.5-flash')
+# The Gemini quota is shared between bot workers, so N workers together stay within it
+analysis_engine = AnalysisEngine(
+    model,
+    max_concurrency=max(1, GEMINI_MAX_CONCURRENCY // WORKER_SHARE),
+    timeout=GEMINI_TIMEOUT,
+    scheduler=GeminiScheduler(
+        rate_per_minute=GEMINI_RATE_PER_MINUTE / WORKER_SHARE,
+        burst=max(1, GEMINI_BURST // WORKER_SHARE),
+        max_in_flight=max(1, GEMINI_MAX_CONCURRENCY // WORKER_SHARE)
+    )
+)
+image_preprocessor = ImagePreprocessor(
+    workers=max(1, IMAGE_WORKERS // WORKER_SHARE) if IMAGE_WORKERS else 0,
+    image_format=IMAGE_FORMAT,
+    quality=IMAGE_QUALITY
+)
+# Every bot worker evicts from its own directory, sharing the size budget
+image_cache = ImageDiskCache(
+    IMAGE_CACHE_DIR if WORKER_INDEX is None else os.path.join(IMAGE_CACHE_DIR, f"worker{WORKER_INDEX}"),
+    max_bytes=IMAGE_CACHE_MB * 1024 * 1024 // WORKER_SHARE
+)
+analysis_cache = AnalysisCache(
+    db,
+    memory_size=ANALYSIS_CACHE_SIZE,
+    db_size=ANALYSIS_CACHE_DB_SIZE,
+    ttl=ANALYSIS_CACHE_TTL
+)
+# Concurrent duplicate requests share one download and one analysis
+image_flights = SingleFlight('image')
+photo_flights = SingleFlight('photo')
+# Per-user order of updates, shared with albums handled outside the dispatcher
+user_locks = UserLocks()
 
 async def check_user_state(update: Update, user_id: int) -> bool:
     """Check user state"""
-    if not db.get_user_state(user_id):
+    if not await db.get_user_state(user_id):
         await update.message.reply_text(
             "Sorry, you need to start the bot first with /start command. 🙏\n"
             "For help, use the /help command."
@@ -100,9 +225,10 @@ async def save_favorite(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not await check_user_state(update, user_id):
             return
         
-        if 'last_analysis' in context.user_data:
-            mode = db.get_user_preference(user_id) or 'general'
-            if db.add_favorite(user_id, context.user_data['last_analysis'], mode):
+        last_analysis = await quick_actions.get_last_analysis(user_id)
+        if last_analysis:
+            mode = await db.get_user_preference(user_id) or 'general'
+            if await db.add_favorite(user_id, last_analysis, mode):
                 await update.message.reply_text("✨ This outfit has been added to your favorites!")
             else:
                 await update.message.reply_text("❌ An error occurred while adding to favorites.")
@@ -111,7 +237,7 @@ async def save_favorite(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await error_handler.handle_database_error(update, e)
 
-async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE, direction: str = 'current'):
     """Show favorite outfits"""
     try:
         # Get user_id based on update type
@@ -127,10 +253,32 @@ async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            # Get favorites from database
-            favorites = db.get_user_favorites(user_id)
+            FAVORITES_PER_PAGE = 1
+            
+            # Work out which page to fetch relative to the page on screen
+            current_page = context.user_data.get('favorites_page', 1)
+            page_bounds = context.user_data.get('favorites_bounds')
+            if update.message or not page_bounds:
+                current_page, cursor, direction = 1, None, 'next'
+            elif direction == 'next':
+                current_page, cursor = current_page + 1, page_bounds[1]
+            elif direction == 'prev':
+                current_page, cursor = current_page - 1, page_bounds[0]
+            else:
+                cursor = page_bounds[0]
+            
+            # Get one page of favorites from database
+            favorites, total_count = await db.get_favorites_page(
+                user_id, FAVORITES_PER_PAGE, cursor, direction
+            )
+            if not favorites and total_count:
+                # The page we were on no longer exists, start over
+                current_page = 1
+                favorites, total_count = await db.get_favorites_page(user_id, FAVORITES_PER_PAGE)
             
             if not favorites:
+                context.user_data.pop('favorites_page', None)
+                context.user_data.pop('favorites_bounds', None)
                 message = "You don't have any saved favorites yet."
                 if update.callback_query:
                     await update.callback_query.message.reply_text(message)
@@ -139,23 +287,19 @@ async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             
             # Calculate pagination
-            FAVORITES_PER_PAGE = 1
-            total_pages = (len(favorites) + FAVORITES_PER_PAGE - 1) // FAVORITES_PER_PAGE
-            current_page = context.user_data.get('favorites_page', 1)
-            
-            # Ensure current page is valid
-            if current_page > total_pages:
-                current_page = 1
-                context.user_data['favorites_page'] = 1
-            
-            # Calculate page indices
+            total_pages = (total_count + FAVORITES_PER_PAGE - 1) // FAVORITES_PER_PAGE
+            current_page = min(max(current_page, 1), total_pages)
+            context.user_data['favorites_page'] = current_page
+            context.user_data['favorites_bounds'] = (
+                (favorites[0][3], favorites[0][0]),
+                (favorites[-1][3], favorites[-1][0])
+            )
             start_idx = (current_page - 1) * FAVORITES_PER_PAGE
-            end_idx = min(start_idx + FAVORITES_PER_PAGE, len(favorites))
             
             # Create favorites text
             favorites_text = f"🌟 Your Favorite Outfits (Page {current_page}/{total_pages}):\n\n"
             
-            for i, (fav_id, analysis, mode, created_at) in enumerate(favorites[start_idx:end_idx], start_idx + 1):
+            for i, (fav_id, analysis, mode, created_at) in enumerate(favorites, start_idx + 1):
                 favorites_text += f"Favorite #{i} (ID: {fav_id})\n"
                 favorites_text += f"Date: {created_at}\n"
                 favorites_text += f"Mode: {mode.title()}\n"
@@ -213,7 +357,7 @@ async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
     except Exception as e:
         logger.error(f"Error in show_favorites: {str(e)}")
-        await error_handler.handle_error(update, context)
+        await error_handler.handle_error(update, context, e)
 
 async def delete_favorite_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Delete a specific favorite"""
@@ -229,7 +373,7 @@ async def delete_favorite_command(update: Update, context: ContextTypes.DEFAULT_
         
         try:
             favorite_id = int(context.args[0])
-            if db.delete_favorite(favorite_id, user_id):
+            if await db.delete_favorite(favorite_id, user_id):
                 await update.message.reply_text(f"✅ Favorite with ID {favorite_id} has been successfully deleted.")
             else:
                 await update.message.reply_text("❌ No favorite found with the specified ID.")
@@ -238,6 +382,73 @@ async def delete_favorite_command(update: Update, context: ContextTypes.DEFAULT_
     except Exception as e:
         await error_handler.handle_database_error(update, e)
 
+async def search_favorites_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Search favorites by words in the analysis or mode"""
+    try:
+        user_id = update.message.from_user.id
+        if not await check_user_state(update, user_id):
+            return
+        
+        terms = " ".join(context.args or [])
+        if not terms:
+            await update.message.reply_text(
+                "❌ Please specify what you are looking for.\n"
+                "Example: /search_favorites blazer"
+            )
+            return
+        
+        results = await db.search_favorites(user_id, terms, SEARCH_RESULTS_LIMIT)
+        if not results:
+            await update.message.reply_text(f"🔍 No favorites found for \"{terms}\".")
+            return
+        
+        lines = [f"🔍 Favorites matching \"{terms}\":\n"]
+        for fav_id, snippet, mode, created_at in results:
+            lines.append(f"Favorite ID: {fav_id} | {mode.title()} | {created_at}")
+            lines.append(snippet)
+            lines.append("─" * 30)
+        lines.append("\nTo delete a favorite: /delete_favorite <favorite_id>")
+        await update.message.reply_text("\n".join(lines)[:MAX_MESSAGE_LENGTH])
+    except Exception as e:
+        await error_handler.handle_database_error(update, e)
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send all favorites as one compressed file (/export [txt|json|md])"""
+    try:
+        user_id = update.message.from_user.id
+        if not await check_user_state(update, user_id):
+            return
+        
+        fmt = (context.args[0].lower().lstrip('.') if context.args else 'txt')
+        if fmt not in EXPORT_FORMATS:
+            await update.message.reply_text(
+                f"❌ Unknown format. Please use one of: {', '.join(EXPORT_FORMATS)}\n"
+                "Example: /export json"
+            )
+            return
+        
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+        os.close(fd)
+        try:
+            # The file is written batch by batch on a database thread
+            count = await db.export_favorites(user_id, path, fmt, EXPORT_BATCH_SIZE)
+            if not count:
+                await update.message.reply_text("You don't have any saved favorites yet.")
+                return
+            document = await asyncio.to_thread(open, path, 'rb')
+            try:
+                await update.message.reply_document(
+                    document=document,
+                    filename=f"favorites.{fmt}.gz",
+                    caption=f"🌟 {count} favorite outfit(s)"
+                )
+            finally:
+                await asyncio.to_thread(document.close)
+        finally:
+            await asyncio.to_thread(os.remove, path)
+    except Exception as e:
+        await error_handler.handle_database_error(update, e)
+
 async def tips_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show photo shooting tips"""
     await update.message.reply_text(PHOTO_TIPS)
@@ -249,7 +460,7 @@ async def faq_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command handler"""
     user_id = update.message.from_user.id
-    db.set_user_state(user_id, True)
+    await db.set_user_state(user_id, True, defer=True)
     
     commands = [
         BotCommand("start", "Start the style assistant 👋"),
@@ -257,6 +468,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         BotCommand("tips", "Photo shooting tips 📸"),
         BotCommand("faq", "Frequently asked questions ❓"),
         BotCommand("favorites", "Your favorite outfits 🌟"),
+        BotCommand("search_favorites", "Search your favorite outfits 🔍"),
+        BotCommand("export", "Download your favorites as a file 📦"),
         BotCommand("save", "Save last analysis ⭐"),
         BotCommand("last", "Show last analysis 🔍"),
         BotCommand("finish", "End conversation 👋")
@@ -293,6 +506,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/help - Show this help menu\n"
         "/finish - End conversation\n"
         "/favorites - View your favorite outfits\n"
+        "/search_favorites <words> - Search your favorite outfits\n"
+        "/export [txt|json|md] - Download your favorites as a file\n"
         "/save - Save last analysis\n"
         "/last - Show last analysis\n\n"
         "📸 How to use:\n"
@@ -317,7 +532,7 @@ async def finish_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         try:
             # Check user state first
-            current_state = db.get_user_state(user_id)
+            current_state = await db.get_user_state(user_id)
             if not current_state:
                 await update.message.reply_text(
                     "No active session found.\n"
@@ -325,20 +540,10 @@ async def finish_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 return
 
-            # Try each database operation separately
-            success = True
-            
-            if not db.set_user_state(user_id, False):
-                success = False
-                logger.error(f"Failed to update user state: {user_id}")
-            
-            if not db.set_user_preference(user_id, None):
-                success = False
-                logger.error(f"Failed to clear user preference: {user_id}")
-            
-            if not db.set_user_event(user_id, ""):
-                success = False
-                logger.error(f"Failed to clear user event: {user_id}")
+            # Clear state, mode and event in a single write
+            success = await db.reset_user_session(user_id)
+            if not success:
+                logger.error(f"Failed to reset user session: {user_id}")
             
             # Clear context data
             if context.user_data:
@@ -366,7 +571,7 @@ async def finish_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
     except Exception as e:
         logger.error(f"General error - finish_command: {str(e)}")
-        await error_handler.handle_error(update, context)
+        await error_handler.handle_error(update, context, e)
         return
 
 async def show_mode_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -398,7 +603,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         if query.data == 'delete_all_favorites':
-            deleted_count = db.delete_all_favorites(user_id)
+            deleted_count = await db.delete_all_favorites(user_id)
+            context.user_data.pop('favorites_page', None)
+            context.user_data.pop('favorites_bounds', None)
             if deleted_count > 0:
                 await query.message.reply_text(f"✅ All your favorites have been deleted. ({deleted_count} favorites)")
             else:
@@ -406,13 +613,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         if query.data == 'prev_favorites':
-            context.user_data['favorites_page'] = max(1, context.user_data.get('favorites_page', 1) - 1)
-            await show_favorites(update, context)
+            await show_favorites(update, context, direction='prev')
             return
             
         if query.data == 'next_favorites':
-            context.user_data['favorites_page'] = context.user_data.get('favorites_page', 1) + 1
-            await show_favorites(update, context)
+            await show_favorites(update, context, direction='next')
             return
         
         if query.data == 'show_tips':
@@ -428,17 +633,17 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
             
         if query.data == 'save_favorite':
-            if 'last_analysis' in context.user_data:
-                mode = db.get_user_preference(user_id) or 'general'
-                db.add_favorite(user_id, context.user_data['last_analysis'], mode)
+            last_analysis = await quick_actions.get_last_analysis(user_id)
+            if last_analysis:
+                mode = await db.get_user_preference(user_id) or 'general'
+                await db.add_favorite(user_id, last_analysis, mode)
                 await query.message.reply_text("✨ This outfit has been added to your favorites!")
             else:
                 await query.message.reply_text("❌ No analysis found to save.")
             return
             
         if query.data == 'special_event':
-            db.set_user_state(user_id, True)
-            db.set_user_preference(user_id, query.data)
+            await db.update_user_session(user_id, is_active=True, mode=query.data)
             await query.edit_message_text(
                 "🎉 You've selected Special Event mode.\n\n"
                 "Please specify your event (e.g., wedding, graduation, job interview, engagement, etc.)"
@@ -455,8 +660,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        db.set_user_state(user_id, True)
-        db.set_user_preference(user_id, query.data)
+        await db.update_user_session(user_id, defer=True, is_active=True, mode=query.data)
         
         messages = {
             'professional': '👔 You\'ve selected Business Wardrobe Assistant mode.\n\n'
@@ -470,10 +674,23 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                       'Please send a photo of the outfit you\'d like me to analyze.'
         }
         
+        # With multi-mode analysis the last photo may already be analyzed in this mode
+        image_hash = context.user_data.get('last_image_hash')
+        if MULTI_MODE_ANALYSIS and image_hash and query.data in MULTI_MODES:
+            analysis_text = await analysis_cache.get(AnalysisCache.make_key(image_hash, query.data))
+            if analysis_text:
+                await query.edit_message_text(
+                    text=messages[query.data].split('\n\n')[0] + "\n\n📸 Here is this mode's analysis of your last photo:"
+                )
+                await quick_actions.save_last_analysis(user_id, analysis_text)
+                await query.message.reply_text(analysis_text)
+                await send_analysis_actions(query.message)
+                return
+        
         await query.edit_message_text(text=messages[query.data])
         
     except Exception as e:
-        await error_handler.handle_error(update, context)
+        await error_handler.handle_error(update, context, e)
 
 async def handle_event_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle special event text"""
@@ -492,7 +709,7 @@ async def handle_event_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return WAITING_FOR_EVENT
         
-        db.set_user_event(user_id, event_text)
+        await db.set_user_event(user_id, event_text)
         
         await update.message.reply_text(
             f"🎉 I'll provide style suggestions for your '{event_text}' event.\n"
@@ -502,107 +719,340 @@ async def handle_event_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
         
     except Exception as e:
-        await error_handler.handle_error(update, context)
+        await error_handler.handle_error(update, context, e)
         return ConversationHandler.END
 
+async def send_analysis_actions(message):
+    """Offer the follow-up actions under an analysis"""
+    keyboard = [
+        [InlineKeyboardButton("⭐ Quick Save", callback_data='quick_save')],
+        [InlineKeyboardButton("🔄 Change Mode", callback_data='change_mode')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await message.reply_text(
+        "Here are my suggestions! What would you like to do?",
+        reply_markup=reply_markup
+    )
+
+def analysis_prompts(user_event: Optional[str]) -> dict:
+    """Analysis prompt for every mode"""
+    return {
+        'professional': (
+            "Analyze this outfit for a professional business environment and suggest a matching combination. "
+            "Please respond in the following format:\n"
+            "1. Outfit in photo: [detailed description]\n"
+            "2. Suggested business outfit: [professional environment-appropriate combination]\n"
+            "3. Style tips: [business environment suggestions]"
+        ),
+        'student': (
+            "Analyze this outfit for an affordable and stylish look and suggest a budget-friendly combination. "
+            "Please respond in the following format:\n"
+            "1. Outfit in photo: [detailed description]\n"
+            "2. Suggested budget outfit: [affordable alternatives combination]\n"
+            "3. Budget tips: [budget shopping suggestions]"
+        ),
+        'fashion': (
+            "Analyze this outfit according to the latest trends and suggest a modern combination. "
+            "Please respond in the following format:\n"
+            "1. Outfit in photo: [detailed description]\n"
+            "2. Trend outfit suggestion: [current fashion trends combination]\n"
+            "3. Season trends: [current season trend tips]"
+        ),
+        'special_event': (
+            f"Analyze this outfit for {user_event} and suggest a matching combination. "
+            "Please respond in the following format:\n"
+            "1. Outfit in photo: [detailed description]\n"
+            "2. Suggested event outfit: [event-appropriate combination]\n"
+            "3. Event style tips: [special occasion suggestions]\n"
+            "4. Accessory suggestions: [event-appropriate accessories]"
+        )
+    }
+
+async def analyze_all_modes(processed_image, prompts: dict, user_id: int, user_mode: str,
+                            on_queue_position) -> str:
+    """Analyze an image for all multi-mode perspectives in one Gemini call.
+
+    Every section is cached under its own mode, so switching to another
+    mode for the same photo needs no new upload or Gemini call.
+    """
+    response = await analysis_engine.analyze(
+        build_multi_mode_prompt({mode: prompts[mode] for mode in MULTI_MODES}),
+        processed_image.as_blob(),
+        user_id=user_id,
+        on_queue_position=on_queue_position
+    )
+    try:
+        sections = parse_multi_mode_response(response)
+    except ValueError as e:
+        logger.warning(f"Invalid multi-mode response, analyzing {user_mode} only: {e}")
+        sections = {user_mode: await analysis_engine.analyze(
+            prompts[user_mode], processed_image.as_blob(), user_id=user_id
+        )}
+
+    for mode, section in sections.items():
+        await analysis_cache.set(AnalysisCache.make_key(processed_image.phash, mode), section)
+    return sections[user_mode]
+
+async def load_photo(photo_size: PhotoSize, photo: File) -> ProcessedImage:
+    """Download and preprocess a photo and keep the result in the disk cache.
+
+    Concurrent requests for the same photo share one download.
+    """
+    async def download_and_process():
+        with metrics.timer('bot_photo_stage_seconds', stage='download'):
+            photo_bytes = await photo.download_as_bytearray()
+        with metrics.timer('bot_photo_stage_seconds', stage='preprocess'):
+            processed_image = await image_preprocessor.process(photo_bytes)
+        await image_cache.put(photo_size.file_unique_id, processed_image)
+        return processed_image
+    
+    return await image_flights.run(photo_size.file_unique_id, download_and_process)
+
+async def get_photo_session(update: Update) -> Optional[dict]:
+    """User session if a photo can be analyzed now, otherwise tell the user why not"""
+    session = await db.get_user_session(update.message.from_user.id)
+    if not session['is_active']:
+        await update.message.reply_text(
+            "Sorry, you need to start the bot first with /start command and select a mode. 🙏\n"
+            "For help, use the /help command."
+        )
+        return None
+        
+    if not session['mode']:
+        keyboard = [
+            [InlineKeyboardButton("👉 Select Mode", callback_data='show_modes')]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(
+            "You haven't selected a mode yet. Please select a mode for analysis.\n"
+            "You can use the button below or /start command to select a mode.",
+            reply_markup=reply_markup
+        )
+        return None
+    return session
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Photo handler"""
+    if update.message.media_group_id and ALBUM_WINDOW > 0:
+        # Photos of an album are analyzed together once the album is complete
+        album_collector.add((update.message.chat_id, update.message.media_group_id), update, context)
+        return
+    await analyze_photo(update, context)
+
+class PhotoTooLarge(Exception):
+    """The photo is over the size limit and was not downloaded"""
+
+class PhotoLoadError(Exception):
+    """Fetching or preprocessing the photo failed; the cause is chained"""
+
+async def analyze_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Analyze a single photo"""
     try:
         user_id = update.message.from_user.id
-        
-        if not db.get_user_state(user_id):
-            await update.message.reply_text(
-                "Sorry, you need to start the bot first with /start command and select a mode. 🙏\n"
-                "For help, use the /help command."
-            )
+        session = await get_photo_session(update)
+        if session is None:
             return
-            
-        user_mode = db.get_user_preference(user_id)
-        if not user_mode:
-            keyboard = [
-                [InlineKeyboardButton("👉 Select Mode", callback_data='show_modes')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        user_mode = session['mode']
+        user_event = session['event']
+        prompts = analysis_prompts(user_event)
+
+        photo_size = select_photo_size(update.message.photo)
+        processing_message = None
+        streamed_message = None
+
+        async def prepare_and_analyze():
+            # Only runs for the first of concurrent identical requests, so the
+            # processing message, queue positions and streaming belong to it
+            nonlocal processing_message, streamed_message
+            try:
+                # A photo analyzed before (e.g. in another mode) needs no network I/O
+                with metrics.timer('bot_photo_stage_seconds', stage='image_cache'):
+                    processed_image = await image_cache.get(photo_size.file_unique_id)
+                if processed_image is None:
+                    with metrics.timer('bot_photo_stage_seconds', stage='get_file'):
+                        photo = await photo_size.get_file()
+                    if photo.file_size > 5000000:  # 5MB
+                        raise PhotoTooLarge()
+            except PhotoTooLarge:
+                raise
+            except Exception as e:
+                raise PhotoLoadError(str(e)) from e
+
+            processing_message = await update.message.reply_text(
+                "🔍 Analyzing your photo...\n⏳ This may take a few seconds..."
+            )
+            if processed_image is None:
+                try:
+                    processed_image = await load_photo(photo_size, photo)
+                except Exception as e:
+                    raise PhotoLoadError(str(e)) from e
+
+            cache_key = AnalysisCache.make_key(processed_image.phash, user_mode, user_event)
+            with metrics.timer('bot_photo_stage_seconds', stage='cache_lookup'):
+                analysis_text = await analysis_cache.get(cache_key)
+            if analysis_text is not None:
+                return processed_image.phash, analysis_text
+
+            async def show_queue_position(position: int):
+                await processing_message.edit_text(
+                    f"🔍 Analyzing your photo...\n⏳ You are #{position} in the queue..."
+                )
+
+            with metrics.timer('bot_photo_stage_seconds', stage='analysis'):
+                if MULTI_MODE_ANALYSIS and user_mode in MULTI_MODES:
+                    # JSON output cannot be shown while it streams
+                    analysis_text = await analyze_all_modes(
+                        processed_image, prompts, user_id, user_mode, show_queue_position
+                    )
+                    return processed_image.phash, analysis_text
+
+                if GEMINI_STREAM:
+                    streamed_message = ProgressiveMessage(processing_message, min_interval=STREAM_EDIT_INTERVAL)
+
+                analysis_text = await analysis_engine.analyze(
+                    prompts[user_mode],
+                    processed_image.as_blob(),
+                    user_id=user_id,
+                    on_queue_position=show_queue_position,
+                    on_text=streamed_message.update if streamed_message else None
+                )
+                await analysis_cache.set(cache_key, analysis_text)
+                return processed_image.phash, analysis_text
+
+        # Identical requests still in flight (same photo, mode and event) share one
+        # get_file(), download and analysis; event text only matters in special event mode
+        flight_key = (
+            photo_size.file_unique_id,
+            user_mode,
+            normalize_event(user_event) if user_mode == 'special_event' else ""
+        )
+        try:
+            image_hash, analysis_text = await photo_flights.run(flight_key, prepare_and_analyze)
+
+            context.user_data['last_image_hash'] = image_hash
+            with metrics.timer('bot_photo_stage_seconds', stage='save'):
+                await quick_actions.save_last_analysis(user_id, analysis_text)
+
+            with metrics.timer('bot_photo_stage_seconds', stage='reply'):
+                # A streamed answer is already in the processing message; finish it in place
+                if streamed_message is None or not await streamed_message.finish(analysis_text):
+                    if processing_message is not None:
+                        await processing_message.delete()
+                    await update.message.reply_text(analysis_text)
+
+                await send_analysis_actions(update.message)
+
+        except PhotoTooLarge:
             await update.message.reply_text(
-                "You haven't selected a mode yet. Please select a mode for analysis.\n"
-                "You can use the button below or /start command to select a mode.",
-                reply_markup=reply_markup
+                "⚠️ Photo size is too large. Please send a smaller photo.\n"
+                "For tips, use the /tips command."
             )
-            return
+        except PhotoLoadError as photo_error:
+            await error_handler.handle_photo_error(update, photo_error.__cause__)
+        except asyncio.TimeoutError as timeout_error:
+            await error_handler.handle_timeout_error(update, timeout_error)
+        except Exception as api_error:
+            await error_handler.handle_api_error(update, api_error)
 
-        photo = await update.message.photo[-1].get_file()
-        if photo.file_size > 5000000:  # 5MB
+    except Exception as e:
+        await error_handler.handle_error(update, context, e)
+
+async def analyze_album(updates: List[Update], context: ContextTypes.DEFAULT_TYPE):
+    """Analyze all photos of an album in one Gemini call and reply once"""
+    update = updates[0]
+    try:
+        if len(updates) == 1:
+            await analyze_photo(update, context)
+            return
+        
+        user_id = update.message.from_user.id
+        session = await get_photo_session(update)
+        if session is None:
+            return
+        user_mode = session['mode']
+        user_event = session['event']
+        
+        photo_sizes = [select_photo_size(album_update.message.photo) for album_update in updates]
+        with metrics.timer('bot_photo_stage_seconds', stage='image_cache'):
+            cached_images = await asyncio.gather(*(image_cache.get(size.file_unique_id) for size in photo_sizes))
+        
+        async def get_file(photo_size, cached_image):
+            return None if cached_image is not None else await photo_size.get_file()
+        
+        with metrics.timer('bot_photo_stage_seconds', stage='get_file'):
+            files = await asyncio.gather(*(get_file(size, image) for size, image in zip(photo_sizes, cached_images)))
+        photos = []
+        skipped = []
+        for number, (size, image, photo) in enumerate(zip(photo_sizes, cached_images, files), start=1):
+            if image is not None or photo.file_size <= 5000000:  # 5MB
+                photos.append((size, image, photo))
+            else:
+                skipped.append(str(number))
+        if not photos:
             await update.message.reply_text(
                 "⚠️ Photo size is too large. Please send a smaller photo.\n"
                 "For tips, use the /tips command."
             )
             return
-
+        if skipped:
+            await update.message.reply_text(
+                f"⚠️ Skipped photo {', '.join(skipped)} of your album: over the 5MB limit. "
+                f"Comparing the other {len(photos)}.\n"
+                "For tips, use the /tips command."
+            )
+        
         processing_message = await update.message.reply_text(
-            "🔍 Analyzing your photo...\n⏳ This may take a few seconds..."
+            f"🔍 Analyzing and comparing your {len(photos)} photos...\n⏳ This may take a few seconds..."
         )
         
         try:
-            photo_bytes = await photo.download_as_bytearray()
-            image = Image.open(io.BytesIO(photo_bytes))
+            async def processed(photo_size, cached_image, photo):
+                return cached_image if cached_image is not None else await load_photo(photo_size, photo)
             
-            max_size = (800, 800)
-            image.thumbnail(max_size, Image.Resampling.LANCZOS)
+            # Downloads and preprocessing of all photos run in parallel
+            processed_images = await asyncio.gather(*(processed(*item) for item in photos))
+            
+            album_hash = "+".join(image.phash for image in processed_images)
+            cache_key = AnalysisCache.make_key(album_hash, user_mode, user_event)
             
-            prompts = {
-                'professional': (
-                    "Analyze this outfit for a professional business environment and suggest a matching combination. "
-                    "Please respond in the following format:\n"
-                    "1. Outfit in photo: [detailed description]\n"
-                    "2. Suggested business outfit: [professional environment-appropriate combination]\n"
-                    "3. Style tips: [business environment suggestions]"
-                ),
-                'student': (
-                    "Analyze this outfit for an affordable and stylish look and suggest a budget-friendly combination. "
-                    "Please respond in the following format:\n"
-                    "1. Outfit in photo: [detailed description]\n"
-                    "2. Suggested budget outfit: [affordable alternatives combination]\n"
-                    "3. Budget tips: [budget shopping suggestions]"
-                ),
-                'fashion': (
-                    "Analyze this outfit according to the latest trends and suggest a modern combination. "
-                    "Please respond in the following format:\n"
-                    "1. Outfit in photo: [detailed description]\n"
-                    "2. Trend outfit suggestion: [current fashion trends combination]\n"
-                    "3. Season trends: [current season trend tips]"
-                ),
-                'special_event': (
-                    f"Analyze this outfit for {db.get_user_event(user_id)} and suggest a matching combination. "
-                    "Please respond in the following format:\n"
-                    "1. Outfit in photo: [detailed description]\n"
-                    "2. Suggested event outfit: [event-appropriate combination]\n"
-                    "3. Event style tips: [special occasion suggestions]\n"
-                    "4. Accessory suggestions: [event-appropriate accessories]"
-                )
-            }
-
             try:
-                response = model.generate_content([prompts[user_mode], image])
-                analysis_text = response.text
-                
-                context.user_data['last_analysis'] = analysis_text
-                quick_actions.save_last_analysis(user_id, analysis_text)
-                
-                await processing_message.delete()
-                
-                await update.message.reply_text(analysis_text)
+                streamed_message = None
+                with metrics.timer('bot_photo_stage_seconds', stage='cache_lookup'):
+                    analysis_text = await analysis_cache.get(cache_key)
+                if analysis_text is None:
+                    async def show_queue_position(position: int):
+                        await processing_message.edit_text(
+                            f"🔍 Analyzing and comparing your {len(photos)} photos...\n"
+                            f"⏳ You are #{position} in the queue..."
+                        )
+                    
+                    if GEMINI_STREAM:
+                        streamed_message = ProgressiveMessage(processing_message, min_interval=STREAM_EDIT_INTERVAL)
+                    with metrics.timer('bot_photo_stage_seconds', stage='analysis'):
+                        analysis_text = await analysis_engine.analyze(
+                            build_album_prompt(analysis_prompts(user_event)[user_mode], len(processed_images)),
+                            [image.as_blob() for image in processed_images],
+                            user_id=user_id,
+                            on_queue_position=show_queue_position,
+                            on_text=streamed_message.update if streamed_message else None
+                        )
+                    await analysis_cache.set(cache_key, analysis_text)
                 
-                keyboard = [
-                    [InlineKeyboardButton("⭐ Quick Save", callback_data='quick_save')],
-                    [InlineKeyboardButton("🔄 Change Mode", callback_data='change_mode')]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+                # Mode switches reuse cached single-photo analyses, which an album has none of
+                context.user_data.pop('last_image_hash', None)
+                with metrics.timer('bot_photo_stage_seconds', stage='save'):
+                    await quick_actions.save_last_analysis(user_id, analysis_text)
                 
-                await update.message.reply_text(
-                    "Here are my suggestions! What would you like to do?",
-                    reply_markup=reply_markup
-                )
+                with metrics.timer('bot_photo_stage_seconds', stage='reply'):
+                    if streamed_message is None or not await streamed_message.finish(analysis_text):
+                        await processing_message.delete()
+                        await update.message.reply_text(analysis_text)
+                    
+                    await send_analysis_actions(update.message)
                 
+            except asyncio.TimeoutError as timeout_error:
+                await error_handler.handle_timeout_error(update, timeout_error)
             except Exception as api_error:
                 await error_handler.handle_api_error(update, api_error)
                 
@@ -610,7 +1060,16 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await error_handler.handle_photo_error(update, photo_error)
             
     except Exception as e:
-        await error_handler.handle_error(update, context)
+        await error_handler.handle_error(update, context, e)
+
+timed_analyze_album = metrics.timed_callback(analyze_album, 'handle_album')
+
+async def handle_album(updates: List[Update], context: ContextTypes.DEFAULT_TYPE):
+    """Handle a collected album like an update: in the user's turn, with its latency recorded"""
+    async with user_locks.hold(updates[0].message.from_user.id):
+        await timed_analyze_album(updates, context)
+
+album_collector = AlbumCollector(handle_album, window=ALBUM_WINDOW)
 
 async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel conversation handler"""
@@ -619,51 +1078,219 @@ async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     return ConversationHandler.END
 
+async def post_stop(application: Application):
+    """Answer albums still being collected while the bot can still send messages"""
+    await album_collector.close()
+
+async def post_shutdown(application: Application):
+    """Release worker threads and database connections"""
+    analysis_engine.shutdown()
+    image_preprocessor.shutdown()
+    await db.close()
+
+async def start_trace(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Give every update its own trace id before any other handler runs"""
+    new_trace_id()
+
+def application_builder():
+    """Application builder with the shared token, timeouts and API server"""
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .connect_timeout(30)
+        .read_timeout(30)
+        .write_timeout(30)
+        .pool_timeout(30)
+    )
+    if TELEGRAM_API_URL:
+        api_url = TELEGRAM_API_URL.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    return builder
+
+def build_application() -> Application:
+    """Create the application with all bot handlers"""
+    application = (
+        application_builder()
+        # Users are served concurrently; each user's updates still run in order
+        .concurrent_updates(UserOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES, locks=user_locks))
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    
+    # Error handling
+    application.add_error_handler(error_handler.handle_error)
+    
+    # Trace id for all log lines of an update, including database and Gemini threads
+    application.add_handler(TypeHandler(Update, start_trace), group=-100)
+    
+    # Special event conversation handler
+    conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(button_callback, pattern='^special_event$')],
+        states={
+            WAITING_FOR_EVENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_event_text)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel_conversation)],
+        allow_reentry=True
+    )
+    
+    # Add command handlers
+    handlers = [
+        CommandHandler("start", start),
+        CommandHandler("help", help_command),
+        CommandHandler("tips", tips_command),
+        CommandHandler("faq", faq_command),
+        CommandHandler("favorites", show_favorites),
+        CommandHandler("save", save_favorite),
+        CommandHandler("last", quick_actions.show_last_analysis),
+        CommandHandler("finish", finish_command),
+        CommandHandler("delete_favorite", delete_favorite_command),
+        CommandHandler("search_favorites", search_favorites_command),
+        CommandHandler("export", export_command),
+        conv_handler,
+        CallbackQueryHandler(button_callback),
+        MessageHandler(filters.PHOTO, handle_photo)
+    ]
+    
+    # Latency is only recorded once metrics are enabled
+    metrics.instrument_handlers(handlers)
+    for handler in handlers:
+        application.add_handler(handler)
+    
+    return application
+
+def start_metrics(port: int):
+    """Serve metrics for this process, including live queue and cache sizes"""
+    metrics.start_http_server(port, METRICS_ADDRESS)
+    metrics.gauge('bot_gemini_queued', "Gemini requests waiting in the scheduler",
+                  lambda: analysis_engine.scheduler.queued)
+    metrics.gauge('bot_gemini_in_flight', "Gemini calls running",
+                  lambda: analysis_engine.scheduler.in_flight)
+    metrics.gauge('bot_write_behind_depth', "Deferred database writes waiting to be flushed",
+                  lambda: db.write_queue.depth)
+    metrics.gauge('bot_session_cache_entries', "User sessions cached in memory",
+                  lambda: len(db.sessions))
+    metrics.gauge('bot_analysis_cache_entries', "Analyses cached in memory",
+                  lambda: len(analysis_cache.memory))
+    metrics.gauge('bot_image_cache_bytes', "Size of the preprocessed photo cache on disk",
+                  lambda: image_cache.total_bytes)
+
+def build_front_application(worker_pool: WorkerPool) -> Application:
+    """Create an application that only forwards updates to the workers"""
+    watcher: Optional[asyncio.Task] = None
+
+    async def forward_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id if update.effective_user else 0
+        worker_pool.submit(user_id, update.to_dict())
+
+    async def watch_workers():
+        # A dead worker would silently swallow its users' updates; stop the bot instead
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            dead = worker_pool.dead_workers()
+            if dead:
+                logger.critical(f"Bot workers exited: {', '.join(dead)}; stopping the bot")
+                application.stop_running()
+                return
+
+    async def start_watcher(application: Application):
+        nonlocal watcher
+        watcher = asyncio.create_task(watch_workers())
+
+    async def stop_workers(application: Application):
+        if watcher is not None:
+            watcher.cancel()
+        await asyncio.get_running_loop().run_in_executor(None, worker_pool.stop)
+        await post_shutdown(application)
+
+    application = (
+        application_builder()
+        .post_init(start_watcher)
+        .post_shutdown(stop_workers)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, forward_update))
+    return application
+
+def run_worker(index: int, queue):
+    """Entry point of a worker process started by the front process"""
+    # Ctrl+C reaches the whole process group; workers stop when the front tells them to
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Logging, caches and limits were set up for this worker on import (see WORKER_INDEX)
+    logger.info(f"Worker {index} is starting...")
+    
+    # The log writer is the only thread so far; fork the image workers without it
+    with writer_thread_stopped():
+        image_preprocessor.start()
+    if METRICS_PORT:
+        # The front uses METRICS_PORT, worker i serves on METRICS_PORT + i + 1
+        start_metrics(METRICS_PORT + index + 1)
+    application = build_application()
+    
+    async def serve():
+        async with application:
+            await application.start()
+            try:
+                await serve_queue(
+                    queue,
+                    lambda data: application.process_update(Update.de_json(data, application.bot)),
+                    locks=user_locks,
+                    max_concurrent=MAX_CONCURRENT_UPDATES
+                )
+            finally:
+                await post_stop(application)
+                await application.stop()
+        await post_shutdown(application)
+    
+    asyncio.run(serve())
+    logger.info(f"Worker {index} has stopped.")
+
+def run_application(application: Application):
+    """Receive updates by polling or through the webhook server"""
+    if TRANSPORT == 'webhook':
+        if not WEBHOOK_URL or not WEBHOOK_SECRET_TOKEN:
+            raise ValueError("WEBHOOK_URL and WEBHOOK_SECRET_TOKEN must be set in webhook mode")
+        logger.info(f"Bot is starting with a webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+        # PTB answers 403 to requests without the matching
+        # X-Telegram-Bot-Api-Secret-Token header
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True,
+            close_loop=False
+        )
+    elif TRANSPORT == 'polling':
+        logger.info("Bot is starting...")
+        application.run_polling(
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True,
+            close_loop=False
+        )
+    else:
+        raise ValueError(f"Unknown TRANSPORT: {TRANSPORT}")
+
 def main():
     """Start the bot"""
+    worker_pool = None
     try:
-        # Create application
-        application = (
-            Application.builder()
-            .token(TELEGRAM_TOKEN)
-            .connect_timeout(30)
-            .read_timeout(30)
-            .write_timeout(30)
-            .pool_timeout(30)
-            .build()
-        )
-        
-        # Error handling
-        application.add_error_handler(error_handler.handle_error)
-        
-        # Special event conversation handler
-        conv_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(button_callback, pattern='^special_event$')],
-            states={
-                WAITING_FOR_EVENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_event_text)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel_conversation)],
-            allow_reentry=True
-        )
-        
-        # Add command handlers
-        handlers = [
-            CommandHandler("start", start),
-            CommandHandler("help", help_command),
-            CommandHandler("tips", tips_command),
-            CommandHandler("faq", faq_command),
-            CommandHandler("favorites", show_favorites),
-            CommandHandler("save", save_favorite),
-            CommandHandler("last", quick_actions.show_last_analysis),
-            CommandHandler("finish", finish_command),
-            CommandHandler("delete_favorite", delete_favorite_command),
-            conv_handler,
-            CallbackQueryHandler(button_callback),
-            MessageHandler(filters.PHOTO, handle_photo)
-        ]
+        if BOT_WORKERS > 0:
+            # Workers are spawned before the front starts any threads
+            worker_pool = WorkerPool(BOT_WORKERS, run_worker, index_env='BOT_WORKER_INDEX')
+            worker_pool.start()
+            application = build_front_application(worker_pool)
+        else:
+            # Fork image workers before the bot starts any threads,
+            # pausing the log writer thread started at import
+            with writer_thread_stopped():
+                image_preprocessor.start()
+            application = build_application()
         
-        for handler in handlers:
-            application.add_handler(handler)
+        if METRICS_PORT:
+            start_metrics(METRICS_PORT)
         
         # Signal handlers for graceful shutdown
         def shutdown(signum=None, frame=None):
@@ -681,22 +1308,24 @@ def main():
                 sys.exit(0)
 
         # Catch signals
-        import signal
         for sig in (signal.SIGINT, signal.SIGTERM):
             signal.signal(sig, shutdown)
         
         # Start bot
-        logger.info("Bot is starting...")
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,
-            close_loop=False
-        )
+        run_application(application)
+        
+        dead_workers = worker_pool.dead_workers() if worker_pool is not None else []
+        if dead_workers:
+            raise SystemExit(f"Bot workers exited: {', '.join(dead_workers)}")
         
     except Exception as e:
         logger.error(f"Error occurred while starting bot: {str(e)}")
         if 'application' in locals():
             shutdown()
+    finally:
+        if worker_pool is not None:
+            # Workers are not daemons; they only exit when told to
+            worker_pool.stop()
 
 if __name__ == '__main__':
     main()
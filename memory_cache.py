@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+class MemoryCache:
+    """Bounded in-process LRU cache with optional TTL expiry.
+
+    Entries are evicted once there are more than max_entries of them, or,
+    when max_bytes is set, once the total sizeof() of all values exceeds it.
+
+    Not thread-safe: intended to be used from the event loop only.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, sizeof: Callable[[Any], int] = len):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key: (expires_at, value, size)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not None
+
+    def _lookup(self, key: Hashable) -> Optional[tuple]:
+        """Return the live entry for key, dropping it if expired"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at = entry[0]
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get value and mark it as recently used"""
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        """Insert or replace value, evicting least recently used entries"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        self._remove(key)
+        self._data[key] = (expires_at, value, size)
+        self.total_bytes += size
+        while len(self._data) > self.max_entries or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes and len(self._data) > 1
+        ):
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
+
+    def _remove(self, key: Hashable) -> Optional[tuple]:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+        return entry
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove key and return its value"""
+        entry = self._remove(key)
+        return entry[1] if entry is not None else default
+
+    def clear(self):
+        """Remove all entries"""
+        self._data.clear()
+        self.total_bytes = 0
@@ -0,0 +1,219 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a fast cache hit to a slow Gemini call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    'bot_handler_seconds': "Time spent in a Telegram update handler",
+    'bot_photo_stage_seconds': "Time spent in each stage of a photo analysis",
+    'bot_gemini_queue_seconds': "Time a Gemini request waited in the scheduler",
+    'bot_gemini_call_seconds': "Duration of Gemini calls",
+    'bot_database_seconds': "Time spent running a Database method on a database thread",
+    'bot_write_behind_flush_seconds': "Time spent writing one write-behind batch",
+    'bot_database_busy_total': "Database calls retried because the database was locked",
+    'bot_errors_total': "Error messages sent to users, by category",
+    'bot_coalesced_total': "Requests that joined an identical call already in flight",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_enabled = False
+_lock = threading.Lock()
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with _lock:
+            values = list(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {value}" for key, value in values)
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, list] = {}  # key: [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            values = [(key, list(series)) for key, series in self._values.items()]
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+_counters: Dict[str, Counter] = {}
+_histograms: Dict[str, Histogram] = {}
+_gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+def enabled() -> bool:
+    return _enabled
+
+def enable():
+    """Start recording; until this is called every function here is a no-op"""
+    global _enabled
+    _enabled = True
+
+def inc(name: str, amount: float = 1.0, **labels):
+    """Increment a counter"""
+    if not _enabled:
+        return
+    counter = _counters.get(name)
+    if counter is None:
+        counter = _counters.setdefault(name, Counter(name, HELP.get(name, name)))
+    counter.inc(amount, **labels)
+
+def observe(name: str, value: float, **labels):
+    """Record a value, usually a duration in seconds, in a histogram"""
+    if not _enabled:
+        return
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms.setdefault(name, Histogram(name, HELP.get(name, name)))
+    histogram.observe(value, **labels)
+
+@contextmanager
+def _timer(name: str, labels: dict):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+_NULL_TIMER = nullcontext()
+
+def timer(name: str, **labels):
+    """Context manager recording the duration of its block"""
+    if not _enabled:
+        return _NULL_TIMER
+    return _timer(name, labels)
+
+def total(name: str) -> float:
+    """Counter total or histogram observation count across all labels"""
+    with _lock:
+        if name in _counters:
+            return sum(_counters[name]._values.values())
+        if name in _histograms:
+            return sum(series[-1] for series in _histograms[name]._values.values())
+    return 0
+
+def gauge(name: str, documentation: str, read: Callable[[], float]):
+    """Register a gauge whose value is read when metrics are scraped"""
+    _gauges[name] = (documentation, read)
+
+def timed_callback(callback: Callable, name: str) -> Callable:
+    """Wrap an async handler callback to record its latency"""
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        if not _enabled:
+            return await callback(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            observe('bot_handler_seconds', time.perf_counter() - start, handler=name)
+    return wrapper
+
+def instrument_handlers(handlers: Iterable):
+    """Record latency for every handler, including those inside conversations"""
+    for handler in handlers:
+        nested = [
+            *getattr(handler, 'entry_points', ()),
+            *(state_handler for state in getattr(handler, 'states', {}).values() for state_handler in state),
+            *getattr(handler, 'fallbacks', ()),
+        ]
+        if nested:
+            instrument_handlers(nested)
+        elif hasattr(handler, 'callback'):
+            handler.callback = timed_callback(handler.callback, handler.callback.__name__)
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for counter in list(_counters.values()):
+        lines.extend(counter.render())
+    for histogram in list(_histograms.values()):
+        lines.extend(histogram.render())
+    for name, (documentation, read) in list(_gauges.items()):
+        try:
+            value = read()
+        except Exception as e:
+            logger.warning(f"Could not read gauge {name}: {e}")
+            continue
+        lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} gauge", f"{name} {value}"])
+    return "\n".join(lines) + "\n"
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port: int, address: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Enable metrics and serve them on http://address:port/metrics"""
+    enable()
+    server = ThreadingHTTPServer((address, port), _MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{address}:{port}/metrics")
+    return server
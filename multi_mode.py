@@ -0,0 +1,43 @@
+import json
+import re
+from typing import Dict, Mapping
+
+# Modes whose prompts do not depend on user input and can share one call
+MULTI_MODES = ('professional', 'student', 'fashion')
+
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+def build_multi_mode_prompt(prompts: Mapping[str, str]) -> str:
+    """Combine the per-mode prompts into one request for a JSON object"""
+    sections = "\n\n".join(f'"{mode}": {prompt}' for mode, prompt in prompts.items())
+    keys = ", ".join(f'"{mode}"' for mode in prompts)
+    return (
+        "Analyze this outfit from several perspectives. For each key below, write the "
+        "analysis the instruction asks for, exactly in the format it describes.\n\n"
+        f"{sections}\n\n"
+        f"Respond with only a JSON object with the keys {keys}, each holding that "
+        "analysis as a single string. Do not add any text outside the JSON object."
+    )
+
+def parse_multi_mode_response(text: str, modes=MULTI_MODES) -> Dict[str, str]:
+    """Extract the per-mode analyses from a JSON answer.
+
+    Raises ValueError if the answer is not a JSON object with a non-empty
+    string for every mode.
+    """
+    cleaned = _CODE_FENCE.sub("", text.strip())
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("No JSON object in multi-mode response")
+
+    data = json.loads(cleaned[start:end + 1])
+    if not isinstance(data, dict):
+        raise ValueError("Multi-mode response is not a JSON object")
+
+    sections = {}
+    for mode in modes:
+        section = data.get(mode)
+        if not isinstance(section, str) or not section.strip():
+            raise ValueError(f"Multi-mode response has no analysis for {mode}")
+        sections[mode] = section.strip()
+    return sections
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+from typing import Optional, Set
+from telegram import Message
+from telegram.error import RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+class ProgressiveMessage:
+    """Edits a message in place as streamed text arrives.
+
+    update() can be called for every chunk; edits are throttled to one per
+    min_interval seconds and always show the latest text, so a fast stream
+    does not run into Telegram's edit rate limits.
+    """
+
+    def __init__(self, message: Message, min_interval: float = 1.5, cursor: str = " ▌"):
+        self.message = message
+        self.min_interval = min_interval
+        self.cursor = cursor
+        self._text = ""
+        self._shown = ""
+        self._last_edit = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._edit_lock = asyncio.Lock()
+        self._finished = False
+
+    def update(self, text: str):
+        """Record the text received so far and schedule an edit"""
+        if self._finished:
+            return
+        self._text = text
+        if self._timer is not None or self._tasks:
+            return
+        delay = self._last_edit + self.min_interval - time.monotonic()
+        if delay > 0:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._start_edit)
+        else:
+            self._start_edit()
+
+    def _start_edit(self):
+        self._timer = None
+        task = asyncio.ensure_future(self._edit(self._text + self.cursor))
+        self._tasks.add(task)
+        task.add_done_callback(self._edit_done)
+
+    def _edit_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        # Text may have arrived while the edit was in flight
+        if not self._finished and self._text + self.cursor != self._shown:
+            self.update(self._text)
+
+    async def _edit(self, text: str) -> bool:
+        text = text[:MAX_MESSAGE_LENGTH]
+        async with self._edit_lock:
+            if not text.strip() or text == self._shown:
+                return True
+            self._last_edit = time.monotonic()
+            try:
+                await self.message.edit_text(text)
+            except RetryAfter as e:
+                # Back off for as long as Telegram asks before the next edit
+                self._last_edit = time.monotonic() + e.retry_after
+                return False
+            except TelegramError as e:
+                # Also timeouts and network errors: finish() callers then send the text instead
+                logger.warning(f"Could not edit streamed message: {e}")
+                return False
+            self._shown = text
+            return True
+
+    async def finish(self, text: str) -> bool:
+        """Stop streaming and show the complete text.
+
+        Returns False if the message could not be edited (for example the
+        text is too long for one message or the edit timed out), so the
+        caller can send it instead.
+        """
+        self._finished = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if len(text) > MAX_MESSAGE_LENGTH:
+            return False
+        return await self._edit(text)
@@ -1,38 +1,88 @@
+import sys
+import zlib
 from typing import Optional
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-from database import Database
+from async_database import AsyncDatabase
+from memory_cache import MemoryCache
+
+# Memory an entry takes besides its value, measured with tracemalloc: the
+# OrderedDict node, the (expires_at, value, size) tuple, the key and the floats
+ENTRY_OVERHEAD = 256
+
+def entry_size(value) -> int:
+    """Approximate memory held by one cached analysis, str or compressed bytes"""
+    return sys.getsizeof(value) + ENTRY_OVERHEAD
+
+class LastAnalysisStore:
+    """Single store for each user's last analysis.
+
+    Recent analyses are kept in a memory-capped LRU with TTL expiry,
+    optionally zlib-compressed; the database is the backing tier. Entries
+    are counted with their per-entry overhead, so max_bytes bounds the
+    memory actually used.
+    """
+
+    def __init__(self, database: AsyncDatabase, max_bytes: int = 32 * 1024 * 1024,
+                 ttl: int = 3600, compress: bool = True, compress_min_size: int = 512,
+                 max_entries: int = 100000):
+        self.db = database
+        self.memory = MemoryCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes, sizeof=entry_size)
+        self.compress = compress
+        self.compress_min_size = compress_min_size
+
+    def _encode(self, analysis: str):
+        data = analysis.encode('utf-8')
+        if self.compress and len(data) >= self.compress_min_size:
+            return zlib.compress(data, 6)
+        return analysis
+
+    @staticmethod
+    def _decode(value) -> str:
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode('utf-8')
+        return value
+
+    async def save(self, user_id: int, analysis: str):
+        """Save analysis to memory and (deferred) to the database"""
+        self.memory.set(user_id, self._encode(analysis))
+        await self.db.save_last_analysis(user_id, analysis, defer=True)
+
+    async def get(self, user_id: int) -> Optional[str]:
+        """Get analysis from memory, falling back to the database"""
+        value = self.memory.get(user_id)
+        if value is not None:
+            return self._decode(value)
+        analysis = await self.db.get_last_analysis(user_id)
+        if analysis:
+            self.memory.set(user_id, self._encode(analysis))
+        return analysis
+
+    def discard(self, user_id: int):
+        """Drop analysis from memory"""
+        self.memory.pop(user_id)
 
 class QuickActions:
-    def __init__(self, database: Database):
+    def __init__(self, database: AsyncDatabase, last_analyses: Optional[LastAnalysisStore] = None):
         self.db = database
-        self.last_analyses = {}  # user_id: last_analysis
+        self.last_analyses = last_analyses or LastAnalysisStore(database)
     
-    def save_last_analysis(self, user_id: int, analysis: str):
+    async def save_last_analysis(self, user_id: int, analysis: str):
         """Save last analysis to memory and database"""
-        self.last_analyses[user_id] = analysis
-        self.db.save_last_analysis(user_id, analysis)
+        await self.last_analyses.save(user_id, analysis)
     
-    def get_last_analysis(self, user_id: int) -> Optional[str]:
+    async def get_last_analysis(self, user_id: int) -> Optional[str]:
         """Get last analysis from memory or database"""
-        # First check memory (faster)
-        if user_id in self.last_analyses:
-            return self.last_analyses[user_id]
-        # Fallback to database (persists across restarts)
-        db_analysis = self.db.get_last_analysis(user_id)
-        if db_analysis:
-            self.last_analyses[user_id] = db_analysis
-        return db_analysis
+        return await self.last_analyses.get(user_id)
     
     def clear_last_analysis(self, user_id: int):
         """Clear last analysis from memory"""
-        if user_id in self.last_analyses:
-            del self.last_analyses[user_id]
+        self.last_analyses.discard(user_id)
     
     async def show_last_analysis(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show last analysis"""
         user_id = update.message.from_user.id
-        last_analysis = self.get_last_analysis(user_id)
+        last_analysis = await self.get_last_analysis(user_id)
         
         if not last_analysis:
             await update.message.reply_text(
@@ -55,7 +105,7 @@ class QuickActions:
     async def quick_save_favorite(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Quick save favorite"""
         user_id = update.callback_query.from_user.id
-        last_analysis = self.get_last_analysis(user_id)
+        last_analysis = await self.get_last_analysis(user_id)
         
         if not last_analysis:
             await update.callback_query.message.reply_text(
@@ -64,8 +114,8 @@ class QuickActions:
             return
         
         try:
-            mode = self.db.get_user_preference(user_id) or 'general'
-            self.db.add_favorite(user_id, last_analysis, mode)
+            mode = await self.db.get_user_preference(user_id) or 'general'
+            await self.db.add_favorite(user_id, last_analysis, mode)
             await update.callback_query.message.reply_text(
                 "✨ Analysis successfully added to favorites!"
             )
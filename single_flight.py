@@ -0,0 +1,37 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+import metrics
+
+T = TypeVar('T')
+
+class SingleFlight:
+    """Let concurrent callers with the same key share one in-flight call.
+
+    The first caller for a key starts func() as a task; callers arriving
+    while it runs await the same task instead of starting their own. Once it
+    finishes the key is free again, so later calls run anew. The task is
+    shielded: a waiter being cancelled does not cancel it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """Result of func(), or of the call already running for key"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            metrics.inc('bot_coalesced_total', call=self.name)
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
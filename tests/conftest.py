@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The bot's modules live at the repository root and are not installed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import Database
+
+@pytest.fixture
+def db_path(tmp_path) -> str:
+    return str(tmp_path / "test.db")
+
+@pytest.fixture
+def db(db_path) -> Database:
+    database = Database(db_path)
+    yield database
+    database.close()
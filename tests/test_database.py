@@ -0,0 +1,154 @@
+import asyncio
+import gzip
+import json
+import sqlite3
+
+from async_database import AsyncDatabase
+from database import Database, DatabaseBusyError
+
+LONG_ANALYSIS = "Navy blazer with white sneakers and a light blue shirt. " * 20
+
+def add_favorites(db: Database, user_id: int, count: int):
+    for index in range(count):
+        assert db.add_favorite(user_id, f"analysis {index} for user {user_id}", 'professional')
+
+def test_favorites_pages_with_tied_timestamps(db, db_path):
+    add_favorites(db, 1, 7)
+    # Favorites saved within the same second share created_at
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE favorites SET created_at = '2024-01-01 12:00:00'")
+
+    seen = []
+    page, total = db.get_favorites_page(1, 3)
+    pages = [page]
+    while page:
+        seen.extend(row[0] for row in page)
+        last = page[-1]
+        page, _ = db.get_favorites_page(1, 3, (last[3], last[0]), 'next')
+        pages.append(page)
+
+    assert total == 7
+    assert seen == sorted(seen, reverse=True)
+    assert len(set(seen)) == 7
+
+    first = pages[1][0]
+    previous, _ = db.get_favorites_page(1, 3, (first[3], first[0]), 'prev')
+    assert previous == pages[0]
+    current, _ = db.get_favorites_page(1, 3, (first[3], first[0]), 'current')
+    assert current == pages[1]
+
+def test_search_is_limited_to_the_user(db):
+    db.add_favorite(1, "Red dress with black boots", 'casual')
+    db.add_favorite(2, "Red scarf over a grey coat", 'casual')
+
+    results = db.search_favorites(1, "red")
+    assert len(results) == 1
+    assert "«Red»" in results[0][1]
+    assert db.search_favorites(2, "coat")
+    assert not db.search_favorites(1, "coat")
+
+def test_search_index_follows_deletes(db, db_path):
+    db.add_favorite(1, "Green jacket and jeans", 'casual')
+    db.add_favorite(1, LONG_ANALYSIS, 'professional')
+    db.add_favorite(2, "Green jacket and jeans", 'casual')
+    jacket_id = db.search_favorites(1, "jacket")[0][0]
+
+    assert db.delete_favorite(jacket_id, 1)
+    assert not db.search_favorites(1, "jacket")
+    # The other user's copy of the same text is still indexed
+    assert db.search_favorites(2, "jacket")
+
+    assert db.delete_all_favorites(1) == 1
+    assert not db.search_favorites(1, "blazer")
+    with db.get_connection() as conn:
+        conn.execute("INSERT INTO favorites_fts (favorites_fts, rank) VALUES ('integrity-check', 1)")
+
+def test_favorites_are_writable_without_the_sql_function(db, db_path):
+    db.add_favorite(1, "Green jacket and jeans", 'casual')
+    # A connection of another tool has no decompress_analysis() registered
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("""
+            INSERT INTO favorites (user_id, analysis_hash, mode)
+            SELECT 5, hash, 'casual' FROM analysis_blobs
+        """)
+        conn.execute("DELETE FROM favorites WHERE user_id = 5")
+
+def test_identical_analyses_share_one_blob(db, db_path):
+    db.add_favorite(1, LONG_ANALYSIS, 'professional')
+    db.add_favorite(2, LONG_ANALYSIS, 'professional')
+    db.write_batch(Database.last_analysis_writes(3, LONG_ANALYSIS))
+
+    with sqlite3.connect(db_path) as conn:
+        codec, body_size, size = conn.execute("SELECT codec, length(body), size FROM analysis_blobs").fetchone()
+        assert conn.execute("SELECT COUNT(*) FROM analysis_blobs").fetchone()[0] == 1
+    assert codec == 'zlib'
+    assert body_size < size
+    assert db.get_last_analysis(3) == LONG_ANALYSIS
+
+def test_migrates_inline_analysis_of_a_baseline_database(db_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript("""
+            CREATE TABLE favorites (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                analysis TEXT NOT NULL,
+                mode TEXT NOT NULL DEFAULT 'general',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE last_analysis (
+                user_id INTEGER PRIMARY KEY,
+                analysis TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        for index in range(5):
+            conn.execute("INSERT INTO favorites (user_id, analysis, mode) VALUES (1, ?, 'casual')",
+                         (f"{LONG_ANALYSIS} {index}",))
+        conn.execute("INSERT INTO last_analysis (user_id, analysis) VALUES (1, ?)", (LONG_ANALYSIS,))
+        # The newest favorites were deleted; their ids must not come back
+        conn.execute("DELETE FROM favorites WHERE id >= 4")
+
+    db = Database(db_path)
+    try:
+        page, total = db.get_favorites_page(1, 10)
+        assert total == 3
+        assert sorted(row[1] for row in page) == [f"{LONG_ANALYSIS} {index}" for index in range(3)]
+        assert db.get_last_analysis(1) == LONG_ANALYSIS
+        assert db.search_favorites(1, "blazer")
+
+        db.add_favorite(1, "A new favorite", 'casual')
+        page, _ = db.get_favorites_page(1, 1)
+        assert page[0][0] == 6
+    finally:
+        db.close()
+
+def test_export_starts_over_after_a_busy_retry(tmp_path, db_path):
+    export_path = str(tmp_path / "favorites.json.gz")
+
+    async def export() -> int:
+        db = AsyncDatabase(db_path, retry_delay=0)
+        try:
+            for index in range(7):
+                await db.add_favorite(1, f"analysis {index}", 'casual')
+
+            export_favorites = db.db.export_favorites
+            calls = 0
+
+            def busy_after_writing(user_id, write, batch_size):
+                nonlocal calls
+                calls += 1
+                if calls == 1:
+                    export_favorites(user_id, write, batch_size)
+                    raise DatabaseBusyError("database is locked")
+                return export_favorites(user_id, write, batch_size)
+
+            db.db.export_favorites = busy_after_writing
+            return await db.export_favorites(1, export_path, 'json', batch_size=3)
+        finally:
+            await db.close()
+
+    assert asyncio.run(export()) == 7
+    with gzip.open(export_path, 'rt', encoding='utf-8') as file:
+        rows = json.load(file)
+    assert sorted(row['analysis'] for row in rows) == [f"analysis {index}" for index in range(7)]
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+
+import pytest
+
+from analysis_engine import AnalysisEngine
+from gemini_scheduler import GeminiScheduler
+
+def unlimited_scheduler(max_in_flight: int) -> GeminiScheduler:
+    return GeminiScheduler(rate_per_minute=1e6, burst=1000, max_in_flight=max_in_flight)
+
+def test_in_flight_cap_is_never_exceeded():
+    async def scenario():
+        scheduler = unlimited_scheduler(3)
+        running = peak = 0
+
+        async def call():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(scheduler.run(user_id % 4, call) for user_id in range(20)))
+        return peak, scheduler.in_flight
+
+    assert asyncio.run(scenario()) == (3, 0)
+
+def test_users_are_served_round_robin():
+    async def scenario():
+        scheduler = unlimited_scheduler(1)
+        order = []
+
+        def call(label):
+            async def run():
+                order.append(label)
+                await asyncio.sleep(0)
+            return run
+
+        # User 1 queues five requests before user 2 sends one
+        requests = [scheduler.run(1, call(f"a{index}")) for index in range(5)]
+        requests.append(scheduler.run(2, call("b0")))
+        await asyncio.gather(*requests)
+        return order
+
+    order = asyncio.run(scenario())
+    assert order.index("b0") <= 2
+
+def test_cancelled_requests_give_their_place_back():
+    async def scenario():
+        scheduler = unlimited_scheduler(1)
+        blocker = asyncio.Event()
+        first = asyncio.create_task(scheduler.run(1, blocker.wait))
+        waiting = asyncio.create_task(scheduler.run(2, blocker.wait))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        blocker.set()
+        await first
+        return scheduler.queued, scheduler.in_flight
+
+    assert asyncio.run(scenario()) == (0, 0)
+
+class BlockingModel:
+    """generate_content() blocks until released, like a hung Gemini call"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def generate_content(self, contents, stream=False):
+        self.release.wait()
+        return type('Response', (), {'text': 'done'})()
+
+def test_timed_out_call_keeps_its_slot_until_the_thread_finishes():
+    async def scenario():
+        model = BlockingModel()
+        engine = AnalysisEngine(model, max_concurrency=1, timeout=0.05, scheduler=unlimited_scheduler(1))
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await engine.analyze("prompt", "image", user_id=1)
+            held = engine.scheduler.in_flight
+            # The next call waits for the slot instead of queueing behind the
+            # busy thread with its timeout already running
+            second = asyncio.create_task(engine.analyze("prompt", "image", user_id=2))
+            await asyncio.sleep(0.1)
+            admitted_early = engine.scheduler.in_flight > 1 or second.done()
+            model.release.set()
+            return held, admitted_early, await second, engine.scheduler.in_flight
+        finally:
+            model.release.set()
+            engine.shutdown()
+
+    assert asyncio.run(scenario()) == (1, False, 'done', 0)
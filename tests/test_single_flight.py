@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flights = SingleFlight('test')
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*(flights.run('key', work) for _ in range(5)))
+        in_flight = flights.in_flight
+        # Once the call is done the key is free for a new one
+        again = await flights.run('key', work)
+        return results, in_flight, again
+
+    assert asyncio.run(scenario()) == ([1] * 5, 0, 2)
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flights = SingleFlight('test')
+
+        async def work(value):
+            await asyncio.sleep(0)
+            return value
+
+        return await asyncio.gather(
+            flights.run(('photo', 'casual'), lambda: work(1)),
+            flights.run(('photo', 'professional'), lambda: work(2)),
+        )
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+def test_cancelling_one_waiter_does_not_cancel_the_call():
+    async def scenario():
+        flights = SingleFlight('test')
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 'result'
+
+        leader = asyncio.create_task(flights.run('key', work))
+        follower = asyncio.create_task(flights.run('key', work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == 'result'
+
+def test_errors_reach_every_waiter():
+    async def scenario():
+        flights = SingleFlight('test')
+
+        async def work():
+            await asyncio.sleep(0)
+            raise ValueError("photo too large")
+
+        return await asyncio.gather(*(flights.run('key', work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [type(result) for result in results] == [ValueError] * 3
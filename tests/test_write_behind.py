@@ -0,0 +1,98 @@
+import asyncio
+
+from write_behind import WriteBehindQueue
+
+class FakeWriter:
+    """flush callback that records batches and can be told to fail or block"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.batches = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, statements) -> bool:
+        await self.release.wait()
+        if self.failures:
+            self.failures -= 1
+            return False
+        self.batches.append(statements)
+        return True
+
+def test_writes_to_a_key_are_coalesced():
+    async def scenario():
+        writer = FakeWriter()
+        queue = WriteBehindQueue(writer, flush_interval=60)
+        for value in range(5):
+            queue.put(('session', 1), [("UPDATE", (value,))])
+        queue.put(('session', 2), [("UPDATE", (9,))])
+        await queue.flush()
+        return writer, queue
+
+    writer, queue = asyncio.run(scenario())
+    assert writer.batches == [[("UPDATE", (4,)), ("UPDATE", (9,))]]
+    assert queue.stats()['writes_coalesced'] == 4
+    assert queue.depth == 0
+
+def test_a_full_queue_starts_only_one_flush():
+    async def scenario():
+        writer = FakeWriter()
+        writer.release.clear()
+        queue = WriteBehindQueue(writer, flush_interval=60, max_pending=2)
+        for user_id in range(10):
+            queue.put(('session', user_id), [("UPDATE", (user_id,))])
+        started = len(queue._tasks)
+        writer.release.set()
+        await queue.drain()
+        return started, writer
+
+    started, writer = asyncio.run(scenario())
+    assert started == 1
+    assert sum(len(batch) for batch in writer.batches) == 10
+
+def test_a_batch_being_written_is_still_pending():
+    async def scenario():
+        writer = FakeWriter()
+        writer.release.clear()
+        queue = WriteBehindQueue(writer, flush_interval=60)
+        queue.put(('last_analysis', 1), [("INSERT", (1,))])
+        flush = asyncio.create_task(queue.flush())
+        await asyncio.sleep(0)
+        in_flight = queue.has_pending(('last_analysis', 1))
+        writer.release.set()
+        await flush
+        return in_flight, queue.has_pending(('last_analysis', 1))
+
+    assert asyncio.run(scenario()) == (True, False)
+
+def test_a_failed_flush_retries_writes_not_superseded():
+    async def scenario():
+        writer = FakeWriter(failures=1)
+        writer.release.clear()
+        queue = WriteBehindQueue(writer, flush_interval=0.01)
+        queue.put(('session', 1), [("OLD", (1,))])
+        queue.put(('session', 2), [("OLD", (2,))])
+        flush = asyncio.create_task(queue.flush())
+        await asyncio.sleep(0)
+        # Written again while the failing batch is in flight
+        queue.put(('session', 2), [("NEW", (2,))])
+        writer.release.set()
+        await flush
+        await queue.drain()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert sorted(writer.batches[0]) == [("NEW", (2,)), ("OLD", (1,))]
+
+def test_writes_are_dropped_after_max_retries():
+    async def scenario():
+        writer = FakeWriter(failures=10)
+        queue = WriteBehindQueue(writer, flush_interval=60, max_retries=2)
+        queue.put(('session', 1), [("UPDATE", (1,))])
+        await queue.drain()
+        return writer, queue
+
+    writer, queue = asyncio.run(scenario())
+    assert writer.failures == 7
+    assert not writer.batches
+    assert queue.depth == 0
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+def shard_for(user_id: int, workers: int) -> int:
+    """Worker index that owns user_id"""
+    return user_id % workers
+
+class WorkerPool:
+    """Front-side handle on N worker processes.
+
+    Every item is routed by user id, so one user's updates always reach
+    the same worker in the order they were submitted. Workers are spawned
+    rather than forked: each one builds its own database connections,
+    Gemini client and Telegram bot instead of inheriting the front's.
+
+    Workers are not daemons, since daemonic processes cannot start the
+    image preprocessing pool; stop() must be called to shut them down.
+
+    A spawned worker imports the target's module before target runs. With
+    index_env set, each worker finds its index in that environment variable
+    already while the module is imported.
+    """
+
+    def __init__(self, workers: int, target: Callable, args: tuple = (),
+                 index_env: Optional[str] = None):
+        self.workers = workers
+        self.target = target
+        self.args = args
+        self.index_env = index_env
+        self._context = multiprocessing.get_context('spawn')
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+
+    def start(self):
+        """Start the worker processes"""
+        for index in range(self.workers):
+            queue = self._context.Queue()
+            process = self._context.Process(
+                target=self.target,
+                args=(index, queue) + self.args,
+                name=f"bot-worker-{index}"
+            )
+            if self.index_env is None:
+                process.start()
+            else:
+                # The spawned interpreter inherits the environment at start()
+                os.environ[self.index_env] = str(index)
+                try:
+                    process.start()
+                finally:
+                    del os.environ[self.index_env]
+            self._queues.append(queue)
+            self._processes.append(process)
+        logger.info(f"Started {self.workers} worker processes")
+
+    def dead_workers(self) -> List[str]:
+        """Names and exit codes of workers that died or failed.
+
+        A worker only exits cleanly after stop(), so any other exit code,
+        including being killed by a signal, means it failed.
+        """
+        return [
+            f"{process.name} (exit code {process.exitcode})"
+            for process in self._processes
+            if process.exitcode is not None and process.exitcode != 0
+        ]
+
+    def submit(self, user_id: int, item: Any):
+        """Send item to the worker that owns user_id.
+
+        Raises RuntimeError if that worker has exited, instead of queueing
+        an item nobody will handle.
+        """
+        index = shard_for(user_id, self.workers)
+        process = self._processes[index]
+        if not process.is_alive():
+            raise RuntimeError(f"{process.name} has exited with code {process.exitcode}")
+        self._queues[index].put((user_id, item))
+
+    def stop(self, timeout: float = 30.0):
+        """Let workers finish queued items, then wait for them to exit.
+
+        Safe to call more than once.
+        """
+        for queue in self._queues:
+            queue.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in time, terminating it")
+                process.terminate()
+                process.join()
+        # Processes are kept so dead_workers() still reports failures afterwards
+        self._queues.clear()
+
+class UserLocks:
+    """One FIFO lock per user, dropped again once nobody holds or waits for it"""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._users: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, user_id: Hashable) -> AsyncIterator[None]:
+        """Wait for the user's earlier items, then run the block"""
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, so per-user order is kept
+            async with lock:
+                yield
+        finally:
+            self._users[user_id] -= 1
+            if not self._users[user_id]:
+                del self._users[user_id]
+                del self._locks[user_id]
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Handle updates of different users concurrently, each user's in order.
+
+    With PTB's default processing every update waits for the previous one,
+    so a photo waiting on Gemini holds up all other users. Running updates
+    fully concurrently would instead let one user's updates overtake each
+    other, which ConversationHandler and the session state cannot cope with.
+    Updates without a user run right away. Pass locks to share the per-user
+    order with work started outside the dispatcher.
+    """
+
+    def __init__(self, max_concurrent_updates: int = 256, locks: Optional[UserLocks] = None):
+        super().__init__(max_concurrent_updates)
+        self._locks = locks or UserLocks()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+        async with self._locks.hold(user.id):
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+async def serve_queue(queue: multiprocessing.Queue, handle: Callable[[Any], Awaitable[None]],
+                      locks: Optional[UserLocks] = None, max_concurrent: int = 256):
+    """Worker-side loop: run handle() for every item from the front.
+
+    Items of different users run concurrently; items of the same user run
+    one at a time in arrival order. At most max_concurrent items are taken
+    off the queue at a time, including those waiting for their user's
+    turn; the rest wait in the queue. Returns after the stop sentinel once
+    all running items are done.
+    """
+    loop = asyncio.get_running_loop()
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="worker-queue")
+    locks = locks or UserLocks()
+    slots = asyncio.Semaphore(max_concurrent)
+    tasks: Set[asyncio.Task] = set()
+
+    async def process(user_id: int, item: Any):
+        try:
+            async with locks.hold(user_id):
+                await handle(item)
+        except Exception as e:
+            logger.error(f"Worker failed to process item for user {user_id}: {e}")
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            message: Optional[tuple] = await loop.run_in_executor(reader, queue.get)
+            if message is None:
+                slots.release()
+                break
+            user_id, item = message
+            task = asyncio.create_task(process(user_id, item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        reader.shutdown(wait=False)
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+import metrics
+
+logger = logging.getLogger(__name__)
+
+Statements = List[Tuple[str, tuple]]
+
+class WriteBehindQueue:
+    """Coalescing write-behind buffer with group commit.
+
+    Each key (for example ('session', user_id)) keeps only its latest
+    statements. Pending writes are flushed together in one transaction after
+    flush_interval seconds, or as soon as max_pending keys are waiting.
+
+    A batch being written still counts as pending. If the write fails, keys
+    that were not written again meanwhile are queued for another attempt,
+    up to max_retries times in a row with growing delays.
+    """
+
+    def __init__(self, flush: Callable[[Statements], Awaitable[bool]],
+                 flush_interval: float = 0.05, max_pending: int = 100, max_retries: int = 3):
+        self._flush = flush
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._pending: Dict[Hashable, Statements] = {}
+        self._in_flight: Dict[Hashable, Statements] = {}
+        self._flush_scheduled = False
+        self._failures = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        self.writes_enqueued = 0
+        self.writes_coalesced = 0
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        """Number of keys waiting to be flushed"""
+        return len(self._pending)
+
+    def has_pending(self, key: Hashable) -> bool:
+        """Whether a write for key is queued or being written"""
+        return key in self._pending or key in self._in_flight
+
+    def put(self, key: Hashable, statements: Statements):
+        """Queue statements for key, replacing any earlier pending write"""
+        self.writes_enqueued += 1
+        if self._pending.pop(key, None) is not None:
+            self.writes_coalesced += 1
+        self._pending[key] = statements
+
+        if len(self._pending) >= self.max_pending:
+            self._start_flush()
+        elif self._timer is None:
+            self._schedule_flush(self.flush_interval)
+
+    def discard(self, key: Hashable):
+        """Drop a pending write that has been superseded by a direct write"""
+        self._pending.pop(key, None)
+        # The direct write runs after the batch in flight, so it must not be retried
+        self._in_flight.pop(key, None)
+
+    def _schedule_flush(self, delay: float):
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        # At most one flush waits for the lock; it takes everything pending then
+        if self._flush_scheduled:
+            return
+        self._flush_scheduled = True
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        """Write everything that is pending in a single transaction"""
+        async with self._flush_lock:
+            self._flush_scheduled = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return
+
+            self._in_flight, self._pending = self._pending, {}
+            statements = [statement for writes in self._in_flight.values() for statement in writes]
+
+            start = time.perf_counter()
+            try:
+                success = await self._flush(statements)
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+                success = False
+            self.last_flush_latency = time.perf_counter() - start
+            self.total_flush_latency += self.last_flush_latency
+            self.flush_count += 1
+            metrics.observe('bot_write_behind_flush_seconds', self.last_flush_latency)
+
+            batch, self._in_flight = self._in_flight, {}
+            if success:
+                self._failures = 0
+                return
+
+            self._failures += 1
+            if self._failures > self.max_retries:
+                self._failures = 0
+                logger.error(f"Dropped {len(batch)} write-behind entries after {self.max_retries + 1} failed flushes")
+                return
+            # Keys written again since the batch was taken keep their newer write
+            for key, writes in batch.items():
+                self._pending.setdefault(key, writes)
+            if self._timer is None:
+                self._schedule_flush(self.flush_interval * 2 ** self._failures)
+
+    async def drain(self):
+        """Flush until nothing is pending, retrying failed writes without delay"""
+        while self._pending:
+            await self.flush()
+
+    def stats(self) -> dict:
+        """Queue depth, coalescing and flush latency counters"""
+        return {
+            'depth': self.depth,
+            'writes_enqueued': self.writes_enqueued,
+            'writes_coalesced': self.writes_coalesced,
+            'flush_count': self.flush_count,
+            'last_flush_latency': self.last_flush_latency,
+            'avg_flush_latency': self.total_flush_latency / self.flush_count if self.flush_count else 0.0,
+        }